@@ -0,0 +1,253 @@
+"""
+# Benchmarks of the recommender on synthetic data.
+
+Each benchmark times one of the expensive paths through the code on data
+from synthetic_data.py:
+
+* populate_by_calculating: filling an in-memory BeerDatabase
+* mr_<job>_<reducer>: the MapReduce similarity jobs' reducers, run locally
+  on the job's input format
+* k_nearest: nearest beers, from a sqlite3 database of the jobs' output
+* predict_overall_rating: predictions for random (user, beer) pairs
+* extract_review_content: parsing review divs of fixture beer page HTML
+* sentence_model_train: training a SentenceModel on one user's reviews
+
+The results, with the parameters and the git commit they were measured at,
+are written as JSON; pass an earlier run's file with --compare to see how
+each benchmark has changed.
+"""
+
+import argparse
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import os
+from os.path import dirname, join
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from constants import ASPECTS
+from synthetic_data import make_beers, make_reviews, review_to_html
+
+# the MapReduce jobs and the scraper aren't packages on the path, and the scraper uses implicit relative imports
+sys.path.append(join(dirname(__file__), 'map_reduce'))
+sys.path.append(join(dirname(__file__), 'scraping'))
+
+BENCHMARKS = ['populate_by_calculating', 'mr_reducers', 'k_nearest', 'predict_overall_rating',
+              'extract_review_content', 'sentence_model_train']
+
+@contextmanager
+def quiet():
+    """Silence stdout, since several of the timed functions print their progress."""
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+def timed(func, *args, **kwargs):
+    """Call the function, returning its result and the number of seconds it took."""
+    start = time.time()
+    result = func(*args, **kwargs)
+    return result, time.time() - start
+
+def result(seconds, calls=1, **extra):
+    extra.update({'seconds': seconds, 'calls': calls, 'seconds_per_call': seconds / calls if calls else 0.0})
+    return extra
+
+def get_mr_lines(df, id_col):
+    """Write reviews in the MapReduce jobs' input format, as in the notebook.
+
+    Ratings are relative to the user's average for the beer job (id_col='username')
+    and to the beer's average for the user job (id_col='beer_id').
+
+    """
+    diffs = [df[aspect] - df.groupby(id_col)[aspect].transform('mean') for aspect in ASPECTS]
+    return [' '.join(str(x) for x in row) for row in zip(df['username'], df['beer_id'], *diffs)]
+
+def run_step(func, pairs):
+    """Group (key, value) pairs by key and run a mapper or reducer over the groups.
+
+    Keys and values go through JSON between steps, like they do with mrjob's default protocols.
+
+    """
+    groups = {}
+    for key, value in pairs:
+        groups.setdefault(json.dumps(key), []).append(json.loads(json.dumps(value)))
+    return [output for key in sorted(groups) for output in func(json.loads(key), iter(groups[key]))]
+
+def run_job(job, lines):
+    """Run the two steps of a similarity job locally, timing each reducer. Return the output and the timings."""
+    first_step, second_step = job.steps()
+    timings = {}
+
+    pairs = [output for line in lines for output in first_step['mapper'](None, line)]
+    pairs, timings[first_step['reducer'].__name__] = timed(run_step, first_step['reducer'], pairs)
+    pairs = [output for key, value in pairs for output in second_step['mapper'](key, value)]
+    output, timings[second_step['reducer'].__name__] = timed(run_step, second_step['reducer'], pairs)
+    return output, timings
+
+def write_sim_database(file_name, output):
+    """Write a similarity job's output to a sqlite3 database, like map_reduce/mr_result_parser.py."""
+    connection = sqlite3.connect(file_name)
+    connection.execute("CREATE TABLE similarities (object_id_1 text, object_id_2 text, look real, smell real, taste real, feel real, overall real, support integer)")
+    connection.executemany("INSERT INTO similarities VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(str(id_1), str(id_2)) + tuple(float(s) for s in sims) + (support,) for (id_1, id_2), (sims, support) in output])
+    connection.execute("CREATE INDEX similarities_ids ON similarities (object_id_1, object_id_2)")
+    connection.commit()
+    connection.close()
+
+def bench_populate_by_calculating(df, args, state):
+    from recommender import BeerDatabase, pearson_sim
+
+    # the calculation is quadratic in the number of beers, so only use the most reviewed ones
+    top_beers = df.groupby('beer_id').size().sort_values(ascending=False).index[:args.db_beers]
+    db = BeerDatabase(df[df['beer_id'].isin(top_beers)])
+    with quiet():
+        _, seconds = timed(db.populate_by_calculating, pearson_sim, 'overall')
+    return result(seconds, beers=len(top_beers), pairs=len(top_beers) * (len(top_beers) - 1) / 2)
+
+def bench_mr_reducers(df, args, state):
+    from MRBeerSimilarity import MRBeerSimilarity
+    from MRUserSimilarity import MRUserSimilarity
+
+    results = {}
+    for name, job_class, id_col in [('beer', MRBeerSimilarity, 'username'), ('user', MRUserSimilarity, 'beer_id')]:
+        output, timings = run_job(job_class(args=[]), get_mr_lines(df, id_col))
+        for reducer, seconds in timings.iteritems():
+            results['mr_%s_%s' % (name, reducer)] = result(seconds, pairs=len(output))
+
+        # the other benchmarks use the similarities
+        file_name = join(state['temp_dir'], '%s_sim_database.db' % name)
+        write_sim_database(file_name, output)
+        state['%s_db_file' % name] = file_name
+    return results
+
+def bench_k_nearest(df, args, state):
+    from recommender import k_nearest, SQLBeerDatabase
+
+    beer_db = SQLBeerDatabase(state['beer_db_file'])
+    beer_ids = df['beer_id'].unique()
+    rng = np.random.RandomState(args.seed)
+    sample = rng.choice(beer_ids, min(args.samples, len(beer_ids)), replace=False)
+
+    start = time.time()
+    for beer_id in sample:
+        k_nearest(beer_id, beer_ids, 'overall', beer_db)
+    return result(time.time() - start, calls=len(sample), beers=len(beer_ids))
+
+def bench_predict_overall_rating(df, args, state):
+    from recommender import predict_overall_rating, SQLBeerDatabase, SQLUserDatabase
+
+    beer_db = SQLBeerDatabase(state['beer_db_file'])
+    user_db = SQLUserDatabase(state['user_db_file'])
+    rng = np.random.RandomState(args.seed)
+    usernames = df['username'].unique()
+    beer_ids = df['beer_id'].unique()
+    pairs = zip(rng.choice(usernames, args.samples), rng.choice(beer_ids, args.samples))
+
+    start = time.time()
+    for username, beer_id in pairs:
+        predict_overall_rating(beer_id, username, beer_db, user_db, df)
+    return result(time.time() - start, calls=len(pairs))
+
+def bench_extract_review_content(df, args, state):
+    from BeautifulSoup import BeautifulSoup
+    from scrape_reviews import extract_review_content
+
+    # a fixture beer page with one div per review
+    html = '<html><body>%s</body></html>' % ''.join(review_to_html(review) for _, review in df.head(args.samples).iterrows())
+    soup, parse_seconds = timed(BeautifulSoup, html)
+    divs = soup('div', attrs={'id': 'rating_fullview_content_2'})
+
+    start = time.time()
+    for div in divs:
+        extract_review_content(div)
+    return result(time.time() - start, calls=len(divs), parse_seconds=parse_seconds)
+
+def bench_sentence_model_train(df, args, state):
+    from sentence_model import SentenceModel
+
+    # the user with the most reviews
+    username = df.groupby('username').size().idxmax()
+    user_reviews = df[df['username'] == username]
+    model, init_seconds = timed(SentenceModel, user_reviews)
+    with quiet():
+        _, seconds = timed(model.train, iterations=args.iterations, processes=1)
+    return result(seconds, calls=args.iterations, reviews=len(user_reviews), words=len(model.words), init_seconds=init_seconds)
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=dirname(__file__) or '.').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, old_results):
+    print '%-45s %12s %12s %8s' % ('benchmark', 'old (s)', 'new (s)', 'ratio')
+    for name in sorted(results):
+        new = results[name]['seconds_per_call']
+        old = old_results.get(name, {}).get('seconds_per_call')
+        if old is None:
+            print '%-45s %12s %12.6f' % (name, '-', new)
+        else:
+            print '%-45s %12.6f %12.6f %8.2f' % (name, old, new, new / old if old else float('nan'))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the recommender on synthetic data')
+    parser.add_argument('dest', help='The .json file to which to write the results')
+    parser.add_argument('-u', '--users', type=int, default=1000, help='Number of synthetic users')
+    parser.add_argument('-b', '--beers', type=int, default=200, help='Number of synthetic beers')
+    parser.add_argument('-e', '--exponent', type=float, default=2.0, help='Power law exponent of reviews per user')
+    parser.add_argument('--db-beers', type=int, default=30, help='Number of beers for populate_by_calculating')
+    parser.add_argument('--samples', type=int, default=50, help='Number of calls for the per-call benchmarks')
+    parser.add_argument('--iterations', type=int, default=3, help='SentenceModel training iterations')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, help='Run only these benchmarks')
+    parser.add_argument('--compare', help='A previous results .json file to compare against')
+    args = parser.parse_args()
+
+    print '[INFO] Generating %s users and %s beers' % (args.users, args.beers)
+    beers_df = make_beers(args.beers, seed=args.seed)
+    reviews_df = make_reviews(beers_df, num_users=args.users, exponent=args.exponent, seed=args.seed)
+
+    # k_nearest and predict_overall_rating need the similarity databases written by the MapReduce benchmark
+    benchmarks = args.only or BENCHMARKS
+    if set(benchmarks) & set(['k_nearest', 'predict_overall_rating']):
+        benchmarks = ['mr_reducers'] + [b for b in benchmarks if b != 'mr_reducers']
+
+    results = {}
+    state = {'temp_dir': tempfile.mkdtemp()}
+    try:
+        for name in benchmarks:
+            print '[INFO] Running %s' % name
+            r = globals()['bench_' + name](reviews_df, args, state)
+            if 'seconds' in r:
+                results[name] = r
+            else:
+                results.update(r)
+    finally:
+        shutil.rmtree(state['temp_dir'])
+
+    for name in sorted(results):
+        print '%-45s %10.4f s  (%s calls)' % (name, results[name]['seconds'], results[name]['calls'])
+
+    with open(args.dest, 'w') as f:
+        json.dump({
+            'commit': get_commit(),
+            'timestamp': datetime.now().isoformat(),
+            'parameters': vars(args),
+            'num_reviews': len(reviews_df),
+            'results': results,
+        }, f, indent=1, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(results, json.load(f)['results'])
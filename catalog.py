@@ -0,0 +1,139 @@
+"""
+# Lookups of beer and brewery names and IDs.
+
+A Catalog is built once from the beers DataFrame, replacing lookups that
+scanned the whole DataFrame on every call. Beers that are aliases for
+another beer resolve to the beer they're an alias for: an alias's ID or name
+looks up the canonical beer's name and ID.
+"""
+
+from bisect import bisect_left
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_NUM_COMPLETIONS = 10
+
+def _lower(name):
+    # bytes that aren't UTF-8 (e.g. from a URL) become U+FFFD, which no name starts with
+    return (unicode(name, 'utf_8', 'replace') if isinstance(name, str) else name).lower()
+
+class Catalog(object):
+    def __init__(self, beer_df):
+        beer_ids = beer_df['beer_id'].values.astype(np.int64)
+        alias_ids = pd.to_numeric(beer_df['alias_id'], errors='coerce').values
+        is_alias = ~np.isnan(alias_ids)
+        canonical_ids = np.where(is_alias, np.nan_to_num(alias_ids), beer_ids).astype(np.int64)
+
+        # the first row for an ID wins, as it did with .iloc[0]
+        rows = {}
+        for i, beer_id in enumerate(beer_ids):
+            rows.setdefault(beer_id, i)
+        canonical_rows = [rows.get(c, i) for i, c in enumerate(canonical_ids)]
+
+        beer_names = beer_df['beer_name'].values
+        alias_names = beer_df['alias_name'].values
+        brewery_ids = beer_df['brewery_id'].values
+        brewery_names = beer_df['brewery_name'].values
+
+        names = []
+        for i, r in enumerate(canonical_rows):
+            if is_alias[i] and r == i:
+                # the beer this is an alias for isn't in the DataFrame, so use the name the alias gives it
+                names.append(alias_names[i] if isinstance(alias_names[i], basestring) and alias_names[i] else beer_names[i])
+            else:
+                names.append(beer_names[r])
+
+        # sorted arrays for vectorized lookups
+        order = np.argsort(beer_ids, kind='mergesort')
+        self._beer_ids, first = np.unique(beer_ids[order], return_index=True)
+        self._canonical_ids = canonical_ids[order][first]
+        self._names = np.array(names, dtype=object)[order][first]
+        self._brewery_ids = brewery_ids[order][first]
+
+        self.beer_names = dict(zip(self._beer_ids, self._names))
+        self.canonical_ids = dict(zip(self._beer_ids, self._canonical_ids))
+        self.beer_brewery_ids = dict(zip(self._beer_ids, self._brewery_ids))
+
+        self.beer_ids_by_name = {}
+        for name, canonical_id in zip(beer_names, canonical_ids):
+            self.beer_ids_by_name.setdefault(name, canonical_id)
+
+        self.brewery_names = {}
+        self.brewery_ids_by_name = {}
+        for brewery_id, brewery_name in zip(brewery_ids, brewery_names):
+            self.brewery_names.setdefault(brewery_id, brewery_name)
+            self.brewery_ids_by_name.setdefault(brewery_name, brewery_id)
+
+        # the prefix index: the canonical beers, sorted by lowercased name
+        entries = sorted(set((_lower(name), name, beer_id) for name, beer_id in zip(beer_names[~is_alias], beer_ids[~is_alias])
+                             if isinstance(name, basestring)))
+        self._prefix_keys = [key for key, _, _ in entries]
+        self._prefix_entries = [(name, beer_id) for _, name, beer_id in entries]
+
+    """
+    Beers
+    """
+    def canonical_beer_id(self, beer_id):
+        return self.canonical_ids[beer_id]
+
+    def beer_id_to_name(self, beer_id):
+        return self.beer_names[beer_id]
+
+    def beer_id_to_brewery_id(self, beer_id):
+        return self.beer_brewery_ids[beer_id]
+
+    def beer_name_to_id(self, beer_name):
+        return self.beer_ids_by_name[beer_name]
+
+    """
+    Breweries
+    """
+    def brewery_id_to_name(self, brewery_id):
+        return self.brewery_names[brewery_id]
+
+    def brewery_name_to_id(self, brewery_name):
+        return self.brewery_ids_by_name[brewery_name]
+
+    """
+    Cross-category
+    """
+    def beer_id_to_brewery_name(self, beer_id):
+        return self.brewery_names[self.beer_brewery_ids[beer_id]]
+
+    """
+    Bulk lookups, for arrays of beer IDs; unknown IDs give None
+    """
+    def _lookup(self, values, beer_ids):
+        beer_ids = np.asarray(beer_ids, dtype=np.int64)
+        positions = np.searchsorted(self._beer_ids, beer_ids)
+        positions[positions == len(self._beer_ids)] = 0
+        found = self._beer_ids[positions] == beer_ids if len(self._beer_ids) else np.zeros(len(beer_ids), dtype=bool)
+
+        result = np.empty(len(beer_ids), dtype=object)
+        result[found] = values[positions[found]]
+        return result
+
+    def canonical_beer_ids(self, beer_ids):
+        return self._lookup(self._canonical_ids, beer_ids)
+
+    def beer_ids_to_names(self, beer_ids):
+        return self._lookup(self._names, beer_ids)
+
+    def beer_ids_to_brewery_ids(self, beer_ids):
+        return self._lookup(self._brewery_ids, beer_ids)
+
+    def beer_ids_to_brewery_names(self, beer_ids):
+        return np.array([None if b is None else self.brewery_names.get(b) for b in self.beer_ids_to_brewery_ids(beer_ids)], dtype=object)
+
+    """
+    Autocomplete
+    """
+    def complete(self, prefix, n=DEFAULT_NUM_COMPLETIONS):
+        """Return up to n (beer name, beer ID) pairs of canonical beers whose names start with the prefix, ignoring case."""
+        prefix = _lower(prefix)
+        start = bisect_left(self._prefix_keys, prefix)
+        end = start
+        while end < len(self._prefix_keys) and end - start < n and self._prefix_keys[end].startswith(prefix):
+            end += 1
+        return self._prefix_entries[start:end]
@@ -0,0 +1,26 @@
+"""
+# Constants shared by the recommender notebook and the modules it imports.
+"""
+
+from os.path import dirname, join
+import re
+
+import nltk
+
+DEFAULT_K = 7
+DEFAULT_REG = 3.0
+DEFAULT_ASPECT_REG_PARAM = 3.0
+
+ASPECTS = ['look', 'smell', 'taste', 'feel', 'overall']
+ASPECTS_MINUS_OVERALL = ['look', 'smell', 'taste', 'feel']
+RATINGS = [1.0 + 0.25 * x for x in range(17)] # 1-5, in steps of 0.25
+
+WORD_SPLIT_REGEX = re.compile(r"[\w']+")
+SENTENCE_TOKENIZER = nltk.data.load('tokenizers/punkt/english.pickle')
+
+EXCLUDED_WORDS_FILE = join(dirname(__file__), 'excluded_words.txt')
+
+EXCLUDED_WORDS = set()
+with open(EXCLUDED_WORDS_FILE, 'r') as f:
+    for line in f:
+        EXCLUDED_WORDS.add(line.strip().lower())
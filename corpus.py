@@ -0,0 +1,237 @@
+"""
+# A pre-tokenized corpus of review text.
+
+Every review is split into sentences, and every sentence into the set of its
+non-excluded, lowercased words, exactly once. The result is stored as flat
+integer arrays over a global vocabulary:
+
+* word_ids: the word ids of every sentence, concatenated
+* sentence_offsets: sentence j is word_ids[sentence_offsets[j]:sentence_offsets[j + 1]]
+* review_offsets: review p is sentences review_offsets[p] to review_offsets[p + 1]
+* review_index: the reviews DataFrame index of review p
+
+The arrays are saved as .npy files so that they can be memory-mapped when loaded.
+
+A corpus can be extended with new reviews; new words go at the end of the
+vocabulary, so word ids from before the extension keep their meaning.
+"""
+
+import argparse
+import hashlib
+from multiprocessing import Pool, cpu_count
+from os import makedirs
+from os.path import exists, join
+
+import numpy as np
+import pandas as pd
+
+from constants import WORD_SPLIT_REGEX, SENTENCE_TOKENIZER, EXCLUDED_WORDS
+
+ARRAY_NAMES = ['word_ids', 'sentence_offsets', 'review_offsets', 'review_index']
+VOCABULARY_FILE_NAME = 'vocabulary.txt'
+
+# the number of reviews tokenized by a worker at a time
+CHUNK_SIZE = 5000
+
+def get_review_sentences(text):
+    """Return a list of the sets of words in each sentence of a review's text."""
+    sentences = []
+    for s in SENTENCE_TOKENIZER.tokenize(text):
+        # Don't use sentences that just describe the serving type
+        if s.startswith('Serving type: '):
+            break
+
+        # get all words in the sentence
+        words = set([w.lower() for w in WORD_SPLIT_REGEX.findall(s)])
+
+        # remove common "function" words that aren't useful for our analysis
+        words -= EXCLUDED_WORDS
+
+        sentences.append(words)
+
+    return sentences
+
+def _tokenize_chunk(texts):
+    """Tokenize a chunk of reviews against a vocabulary local to the chunk.
+
+    Returns (vocabulary, word_ids, sentence_lengths, review_lengths), where the
+    word ids index into the local vocabulary; build_corpus maps them to global ids.
+
+    """
+    vocabulary = {}
+    word_ids, sentence_lengths, review_lengths = [], [], []
+    for text in texts:
+        sentences = get_review_sentences(text) if isinstance(text, basestring) else []
+        for words in sentences:
+            word_ids.extend(vocabulary.setdefault(w, len(vocabulary)) for w in words)
+            sentence_lengths.append(len(words))
+        review_lengths.append(len(sentences))
+
+    local_vocabulary = [None] * len(vocabulary)
+    for w, n in vocabulary.iteritems():
+        local_vocabulary[n] = w
+
+    return (local_vocabulary,
+            np.array(word_ids, dtype=np.int32),
+            np.array(sentence_lengths, dtype=np.int64),
+            np.array(review_lengths, dtype=np.int64))
+
+def _offsets(lengths):
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+class Corpus(object):
+    """Tokenized review text; see the module docstring for the layout."""
+    def __init__(self, vocabulary, word_ids, sentence_offsets, review_offsets, review_index):
+        self.vocabulary = vocabulary
+        self.word_ids = word_ids
+        self.sentence_offsets = sentence_offsets
+        self.review_offsets = review_offsets
+        self.review_index = review_index
+
+        self._word_lookup = None
+        self._positions = None
+        self._fingerprints = {}
+
+    def __len__(self):
+        return len(self.review_index)
+
+    @property
+    def word_lookup(self):
+        """A dict from word to word id."""
+        if self._word_lookup is None:
+            self._word_lookup = {w: n for n, w in enumerate(self.vocabulary)}
+        return self._word_lookup
+
+    def get_position(self, df_index):
+        """Return the position in the corpus of the review with the given DataFrame index."""
+        if self._positions is None:
+            self._positions = {i: p for p, i in enumerate(self.review_index)}
+        return self._positions[df_index]
+
+    def get_fingerprint(self, num_words=None):
+        """Return a hash of the first num_words words of the vocabulary (by default, all of them).
+
+        Word ids are positions in the vocabulary, so word ids saved along with
+        the fingerprint of the vocabulary they were taken from can be checked
+        against a corpus before they're used with it.
+
+        """
+        if num_words is None:
+            num_words = len(self.vocabulary)
+        if num_words not in self._fingerprints:
+            md5 = hashlib.md5()
+            for w in self.vocabulary[:num_words]:
+                md5.update((w.encode('utf_8') if isinstance(w, unicode) else w) + '\n')
+            self._fingerprints[num_words] = md5.hexdigest()
+        return self._fingerprints[num_words]
+
+    def extend(self, df):
+        """Return a corpus that also has the reviews in the DataFrame that aren't in this one.
+
+        Reviews already in the corpus aren't tokenized again, so their text is
+        assumed not to have changed.
+
+        """
+        new_reviews = df[~df.index.isin(self.review_index)]
+        local_vocabulary, local_word_ids, sentence_lengths, review_lengths = _tokenize_chunk(list(new_reviews['text']))
+
+        # new words are appended to the vocabulary, so existing word ids don't change
+        vocabulary = list(self.vocabulary)
+        word_lookup = dict(self.word_lookup)
+        mapping = []
+        for w in local_vocabulary:
+            if w not in word_lookup:
+                word_lookup[w] = len(vocabulary)
+                vocabulary.append(w)
+            mapping.append(word_lookup[w])
+        mapping = np.array(mapping, dtype=np.int32)
+
+        return Corpus(
+            vocabulary,
+            np.concatenate([self.word_ids, mapping[local_word_ids] if len(local_word_ids) else local_word_ids]),
+            np.concatenate([self.sentence_offsets, self.sentence_offsets[-1] + np.cumsum(sentence_lengths)]),
+            np.concatenate([self.review_offsets, self.review_offsets[-1] + np.cumsum(review_lengths)]),
+            np.concatenate([self.review_index, np.asarray(new_reviews.index)]))
+
+    def get_sentence_ids(self, df_index):
+        """Return a list of word id arrays, one per sentence of the review with the given DataFrame index."""
+        p = self.get_position(df_index)
+        bounds = self.sentence_offsets[self.review_offsets[p]:self.review_offsets[p + 1] + 1]
+        return [self.word_ids[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def get_sentences(self, df_index):
+        """Return a list of word sets, one per sentence of the review with the given DataFrame index."""
+        vocabulary = self.vocabulary
+        return [set(vocabulary[n] for n in ids) for ids in self.get_sentence_ids(df_index)]
+
+    def save(self, path):
+        if not exists(path):
+            makedirs(path)
+
+        for name in ARRAY_NAMES:
+            np.save(join(path, name + '.npy'), getattr(self, name))
+
+        with open(join(path, VOCABULARY_FILE_NAME), 'w') as f:
+            for w in self.vocabulary:
+                f.write(w + '\n')
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Load a saved corpus; by default the arrays are memory-mapped rather than read into memory."""
+        with open(join(path, VOCABULARY_FILE_NAME), 'r') as f:
+            vocabulary = [line.rstrip('\n') for line in f]
+
+        arrays = [np.load(join(path, name + '.npy'), mmap_mode=mmap_mode) for name in ARRAY_NAMES]
+        return cls(vocabulary, *arrays)
+
+def build_corpus(df, processes=None):
+    """Tokenize the 'text' column of every review in the DataFrame, across a pool of processes."""
+    texts = list(df['text'])
+    chunks = [texts[start:start + CHUNK_SIZE] for start in range(0, len(texts), CHUNK_SIZE)]
+
+    pool = Pool(processes or cpu_count())
+    try:
+        results = pool.map(_tokenize_chunk, chunks)
+    finally:
+        pool.close()
+        pool.join()
+
+    # merge the chunks' local vocabularies into one global vocabulary
+    word_lookup = {}
+    word_ids, sentence_lengths, review_lengths = [], [], []
+    for local_vocabulary, local_word_ids, local_sentence_lengths, local_review_lengths in results:
+        mapping = np.array([word_lookup.setdefault(w, len(word_lookup)) for w in local_vocabulary], dtype=np.int32)
+        word_ids.append(mapping[local_word_ids] if len(local_word_ids) else local_word_ids)
+        sentence_lengths.append(local_sentence_lengths)
+        review_lengths.append(local_review_lengths)
+
+    vocabulary = [None] * len(word_lookup)
+    for w, n in word_lookup.iteritems():
+        vocabulary[n] = w
+
+    return Corpus(
+        vocabulary,
+        np.concatenate(word_ids) if word_ids else np.zeros(0, dtype=np.int32),
+        _offsets(np.concatenate(sentence_lengths) if sentence_lengths else []),
+        _offsets(np.concatenate(review_lengths) if review_lengths else []),
+        np.asarray(df.index))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tokenize review text into a corpus that can be memory-mapped')
+    parser.add_argument('reviews', help='The reviews .csv file')
+    parser.add_argument('dest', help='Directory to which to write the corpus')
+    parser.add_argument('-p', '--processes', type=int, default=None, help='Number of processes to use')
+    args = parser.parse_args()
+
+    # use the same reviews as the recommender: those with a username and a text review
+    reviews_df = pd.read_csv(args.reviews)
+    reviews_df = reviews_df[pd.notnull(reviews_df['username'])]
+    reviews_df = reviews_df[pd.notnull(reviews_df['text'])]
+
+    print '[INFO] Tokenizing %s reviews' % len(reviews_df)
+    corpus = build_corpus(reviews_df, processes=args.processes)
+
+    print '[INFO] Writing %s sentences, %s words to %s' % (len(corpus.sentence_offsets) - 1, len(corpus.vocabulary), args.dest)
+    corpus.save(args.dest)
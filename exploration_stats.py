@@ -0,0 +1,254 @@
+"""
+# Statistics of the reviews for data exploration, computed out of core.
+
+The reviews .csv file is streamed a chunk at a time, so the statistics of
+the full scrape never need it in memory: the number of reviews per user,
+beer, and brewery, their rating averages and spreads, and the distribution
+of each aspect's ratings.
+
+Streaming also collects the (user, beer) pairs into a sparse binary
+user-by-beer matrix R. The common support of two beers, the number of users
+who reviewed both, is then an entry of R^T R, which is computed a block of
+beers at a time so that only the histogram of the supports is kept.
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from constants import ASPECTS, RATINGS
+
+DEFAULT_CHUNK_SIZE = 100000
+
+# the number of beers whose common supports with every other beer are computed at once
+DEFAULT_BLOCK_SIZE = 1000
+
+ID_COLUMNS = ['username', 'beer_id', 'brewery_id']
+COLUMNS = ID_COLUMNS + ['text'] + ASPECTS
+
+# support thresholds printed by the command line, for choosing the regularization and minimum support
+SUPPORT_THRESHOLDS = [1, 2, 3, 5, 10, 20, 50]
+
+def read_reviews(reviews_file_path, chunksize=DEFAULT_CHUNK_SIZE):
+    """Iterate over the reviews .csv file in DataFrames of at most chunksize reviews, with only the columns used here."""
+    return pd.read_csv(reviews_file_path, usecols=COLUMNS, chunksize=chunksize)
+
+def filter_reviews(df):
+    """Keep the reviews used by the recommender: those with a username and a text review, and so with aspect ratings."""
+    return df[pd.notnull(df['username']) & pd.notnull(df['text'])]
+
+def _get_codes(values, index):
+    """Return the position of each value in the index, a dict of value to position that's extended with any new values."""
+    for value in pd.unique(values):
+        index.setdefault(value, len(index))
+    return pd.Series(values).map(index).values.astype(np.int32)
+
+def _binary_matrix(rows, cols, shape):
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=shape)
+    # a user who reviewed a beer twice still counts once
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    return matrix
+
+def get_user_beer_matrix(df):
+    """Return the sparse binary user-by-beer matrix of a DataFrame of reviews, with the usernames and beer IDs of its rows and columns."""
+    df = df[pd.notnull(df['username'])]
+    user_codes, usernames = pd.factorize(df['username'])
+    beer_codes, beer_ids = pd.factorize(df['beer_id'])
+    return _binary_matrix(user_codes, beer_codes, (len(usernames), len(beer_ids))), usernames, beer_ids
+
+class ReviewStats(object):
+    """Review counts and rating totals per user, beer, and brewery, accumulated a chunk of reviews at a time."""
+    def __init__(self):
+        self.num_reviews = 0
+        self.num_text_reviews = 0
+
+        # for each ID column, a DataFrame indexed by ID of the number of reviews and,
+        # for each aspect, the number, sum, and sum of squares of the ratings
+        self.totals = {}
+        self.rating_counts = {aspect: pd.Series(0, index=RATINGS) for aspect in ASPECTS}
+
+        # the user and beer of every review, as positions in user_index and beer_index
+        self.user_index = {}
+        self.beer_index = {}
+        self.user_codes = []
+        self.beer_codes = []
+
+    def add(self, df):
+        """Add a DataFrame of reviews to the statistics."""
+        self.num_reviews += len(df)
+        self.num_text_reviews += df['text'].count()
+
+        ratings = df[ASPECTS]
+        for column in ID_COLUMNS:
+            groups = ratings.groupby(df[column])
+            totals = pd.concat([
+                groups.size().to_frame('reviews'),
+                groups.count().add_suffix('_n'),
+                groups.sum().add_suffix('_sum'),
+                (ratings ** 2).groupby(df[column]).sum().add_suffix('_sum_sq'),
+            ], axis=1)
+            if column in self.totals:
+                totals = self.totals[column].add(totals, fill_value=0)
+            self.totals[column] = totals
+
+        for aspect in ASPECTS:
+            self.rating_counts[aspect] = self.rating_counts[aspect].add(ratings[aspect].value_counts(), fill_value=0)
+
+        df = df[pd.notnull(df['username'])]
+        self.user_codes.append(_get_codes(df['username'].values, self.user_index))
+        self.beer_codes.append(_get_codes(df['beer_id'].values, self.beer_index))
+
+    def num_reviews_by(self, column):
+        """Return a Series of the number of reviews of each ID in the column."""
+        return self.totals[column]['reviews'].astype(np.int64)
+
+    def ratings_by(self, column):
+        """Return a DataFrame of the mean and standard deviation of each aspect's ratings for each ID in the column."""
+        totals = self.totals[column]
+        result = pd.DataFrame(index=totals.index)
+        for aspect in ASPECTS:
+            n = totals[aspect + '_n'].replace(0, np.nan)
+            mean = totals[aspect + '_sum'] / n
+            result[aspect + '_mean'] = mean
+            result[aspect + '_std'] = np.sqrt((totals[aspect + '_sum_sq'] / n - mean ** 2).clip(lower=0))
+        return result
+
+    def rating_distribution(self, aspect):
+        """Return a Series of the number of ratings of the aspect at each rating."""
+        return self.rating_counts[aspect].astype(np.int64).sort_index()
+
+    def summarize_by(self, column):
+        """Return a dict summarizing the number of reviews per ID in the column, including the ID with the most."""
+        num_reviews = self.num_reviews_by(column)
+        summary = summarize_histogram(np.bincount(num_reviews.values))
+        summary['max_id'] = num_reviews.idxmax()
+        return summary
+
+    def user_beer_matrix(self):
+        """Return the sparse binary user-by-beer matrix of the reviews, with the usernames and beer IDs of its rows and columns."""
+        usernames = sorted(self.user_index, key=self.user_index.get)
+        beer_ids = sorted(self.beer_index, key=self.beer_index.get)
+        rows = np.concatenate(self.user_codes) if self.user_codes else np.zeros(0, dtype=np.int32)
+        cols = np.concatenate(self.beer_codes) if self.beer_codes else np.zeros(0, dtype=np.int32)
+        return _binary_matrix(rows, cols, (len(usernames), len(beer_ids))), usernames, beer_ids
+
+def compute_stats(reviews_file_path, chunksize=DEFAULT_CHUNK_SIZE):
+    """Stream the reviews .csv file once, returning ReviewStats of all its reviews and of those the recommender uses."""
+    all_stats = ReviewStats()
+    used_stats = ReviewStats()
+    for chunk in read_reviews(reviews_file_path, chunksize):
+        all_stats.add(chunk)
+        used_stats.add(filter_reviews(chunk))
+    return all_stats, used_stats
+
+def get_common_support_counts(matrix, block_size=DEFAULT_BLOCK_SIZE):
+    """Return counts such that counts[s] is the number of pairs of columns of a binary matrix with s nonzero rows in common.
+
+    For the user-by-beer matrix, that's the number of pairs of beers that s
+    users reviewed in common. Only block_size rows of R^T R are held at once,
+    and only their entries to the right of the diagonal are computed.
+
+    """
+    matrix = sparse.csc_matrix(matrix, dtype=np.int32)
+    transposed = matrix.T.tocsr()
+    num_cols = matrix.shape[1]
+
+    counts = np.zeros(1, dtype=np.int64)
+    for start in range(0, num_cols, block_size):
+        end = min(start + block_size, num_cols)
+        # the common supports of the block's beers with themselves and every later beer
+        block = (transposed[start:end] * matrix[:, start:]).tocoo()
+        # count each pair once, from its lower beer; pairs with no support aren't in the product
+        supports = block.data[(block.col > block.row) & (block.data > 0)]
+        block_counts = np.bincount(supports)
+        if len(block_counts) > len(counts):
+            block_counts[:len(counts)] += counts
+            counts = block_counts.astype(np.int64)
+        else:
+            counts[:len(block_counts)] += block_counts
+
+    counts[0] = num_cols * (num_cols - 1) / 2 - counts[1:].sum()
+    return counts
+
+def summarize_histogram(counts):
+    """Return the mean, median, mode, min, and max of values given as counts, where counts[v] is the number of times v occurs."""
+    counts = np.asarray(counts)
+    values = np.arange(len(counts))
+    total = counts.sum()
+    if total == 0:
+        return {'count': 0, 'mean': 0.0, 'median': 0.0, 'mode': 0, 'mode_count': 0, 'min': 0, 'max': 0}
+
+    # the median of an even number of values is the mean of the middle two, as with np.median
+    cumulative = np.cumsum(counts)
+    middle = np.searchsorted(cumulative, [int(np.ceil(total / 2.0)), total / 2 + 1])
+    nonzero = np.flatnonzero(counts)
+    return {
+        'count': int(total),
+        'mean': float((values * counts).sum()) / total,
+        'median': middle.mean(),
+        'mode': int(counts.argmax()),
+        'mode_count': int(counts.max()),
+        'min': int(nonzero[0]),
+        'max': int(nonzero[-1]),
+    }
+
+def print_summary(summary, description):
+    print 'Reviews per %s stats:' % description.lower()
+    print '    Mean:   %s' % summary['mean']
+    print '    Median: %s' % summary['median']
+    print '    Mode:   %s (%s occurrences)' % (summary['mode'], summary['mode_count'])
+    print '    Min:    %s' % summary['min']
+    print '    Max:    %s (%s)' % (summary['max'], summary['max_id'])
+
+def print_stats(review_stats):
+    print 'Total reviews:    %s' % review_stats.num_reviews
+    print 'Text reviews:     %s' % review_stats.num_text_reviews
+    print
+    print 'Number of users:     %s' % len(review_stats.num_reviews_by('username'))
+    print 'Number of beers:     %s' % len(review_stats.num_reviews_by('beer_id'))
+    print 'Number of breweries: %s' % len(review_stats.num_reviews_by('brewery_id'))
+
+    for column, description in zip(ID_COLUMNS, ['User', 'Beer', 'Brewery']):
+        print
+        print_summary(review_stats.summarize_by(column), description)
+
+    print
+    print 'Rating distributions:'
+    print '    %-8s %s' % ('rating', ' '.join('%8s' % aspect for aspect in ASPECTS))
+    distributions = [review_stats.rating_distribution(aspect) for aspect in ASPECTS]
+    for rating in RATINGS:
+        print '    %-8s %s' % (rating, ' '.join('%8s' % d.get(rating, 0) for d in distributions))
+
+def print_common_support(counts):
+    summary = summarize_histogram(counts)
+    total = summary['count']
+    print 'Common support of %s pairs of beers:' % total
+    print '    Mean:   %s' % summary['mean']
+    print '    Median: %s' % summary['median']
+    print '    Max:    %s' % summary['max']
+    for threshold in SUPPORT_THRESHOLDS:
+        at_least = counts[threshold:].sum()
+        print '    At least %-4s %s (%s%%)' % (threshold, at_least, 100.0 * at_least / total if total else 0.0)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compute review statistics and common supports without loading the reviews into memory')
+    parser.add_argument('reviews', help='The reviews .csv file')
+    parser.add_argument('-c', '--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Number of reviews read at a time')
+    parser.add_argument('-b', '--block-size', type=int, default=DEFAULT_BLOCK_SIZE, help='Number of beers whose common supports are computed at a time')
+    parser.add_argument('--all', action='store_true', help='Include reviews without a username or text, which the recommender ignores')
+    args = parser.parse_args()
+
+    print '[INFO] Reading reviews from %s' % args.reviews
+    all_stats, used_stats = compute_stats(args.reviews, args.chunk_size)
+    review_stats = all_stats if args.all else used_stats
+
+    print
+    print_stats(review_stats)
+
+    print
+    print '[INFO] Computing common supports'
+    matrix, _, _ = review_stats.user_beer_matrix()
+    print_common_support(get_common_support_counts(matrix, args.block_size))
@@ -0,0 +1,325 @@
+"""
+# Opt-in instrumentation of the recommender's hot paths.
+
+Functions decorated with @instrumented, and blocks wrapped in timer(), record
+their call counts and latencies; count() records events such as cache hits
+and misses, and observe() records the distribution of a quantity per call,
+such as rows scanned. Nothing is recorded until enable() is called, and until
+then the hooks cost one flag check per call.
+
+Setting the INSTRUMENTATION_SUMMARY_FILE environment variable enables
+instrumentation when this module is first imported and writes a JSON summary
+of the run to that file when the process exits. Setting
+INSTRUMENTATION_PROFILE_FILE also runs a sampling profiler and writes the
+sampled stacks in the folded format read by flamegraph.pl and speedscope.
+
+Worker processes forked from the instrumented process (a multiprocessing
+Pool's, or the recommendation service's) call init_worker() when they start
+and flush_worker() as they exit; each writes its own summary and profile
+next to the main process's, which merges them into its own at exit.
+"""
+
+import atexit
+from functools import wraps
+from glob import glob
+import json
+import math
+from multiprocessing.util import Finalize
+import os
+import signal
+import sys
+import threading
+import time
+
+SUMMARY_FILE_ENV_VAR = 'INSTRUMENTATION_SUMMARY_FILE'
+PROFILE_FILE_ENV_VAR = 'INSTRUMENTATION_PROFILE_FILE'
+
+# seconds between profiler samples
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+# histogram buckets are powers of two of the values, or for latencies, of microseconds
+NUM_BUCKETS = 32
+
+ENABLED = False
+
+_LOCK = threading.Lock()
+_TIMINGS = {}
+_DISTRIBUTIONS = {}
+_COUNTERS = {}
+_START_TIME = None
+_PROFILER = None
+
+class Distribution(object):
+    """The count, total, maximum, and histogram of the values of a quantity recorded once per call, such as rows scanned."""
+    # values are multiplied by this before they're bucketed
+    scale = 1
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * NUM_BUCKETS
+
+    def add(self, value):
+        self.calls += 1
+        self.total += value
+        self.max = max(self.max, value)
+        scaled = value * self.scale
+        bucket = int(math.log(scaled, 2)) + 1 if scaled >= 1 else 0
+        self.histogram[min(bucket, NUM_BUCKETS - 1)] += 1
+
+    def merge(self, summary):
+        """Add in the values of another process's distribution, given as its summary()."""
+        self.calls += summary['calls']
+        self.total += summary['total']
+        self.max = max(self.max, summary['max'])
+        for bucket, n in enumerate(summary['histogram']):
+            self.histogram[bucket] += n
+
+    def percentile(self, p):
+        """Estimate a percentile as the upper bound of the bucket it falls in."""
+        target = p / 100.0 * self.calls
+        seen = 0
+        for bucket, n in enumerate(self.histogram):
+            seen += n
+            if seen >= target and n:
+                return min(2 ** bucket / float(self.scale), self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'calls': self.calls,
+            'total': self.total,
+            'mean': self.total / self.calls if self.calls else 0.0,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'max': self.max,
+            # bucket i counts values under 2^i (and at least 2^(i-1)), in microseconds for timings
+            'histogram': self.histogram[:max([i + 1 for i, n in enumerate(self.histogram) if n] or [0])],
+        }
+
+class Timing(Distribution):
+    """The call count, total time, and latency histogram, in seconds, of one instrumented function or block."""
+    scale = 1e6
+
+def _add(distributions, distribution_class, name, value):
+    with _LOCK:
+        distribution = distributions.get(name)
+        if distribution is None:
+            distribution = distributions[name] = distribution_class()
+        distribution.add(value)
+
+def _record(name, seconds):
+    _add(_TIMINGS, Timing, name, seconds)
+
+def instrumented(name):
+    """Decorate a function so that its calls are timed under the given name while instrumentation is enabled."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record(name, time.time() - start)
+        return wrapper
+    return decorator
+
+class _Timer(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *exc_info):
+        _record(self.name, time.time() - self.start)
+
+class _NullTimer(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+_NULL_TIMER = _NullTimer()
+
+def timer(name):
+    """Return a context manager that times its block under the given name while instrumentation is enabled."""
+    return _Timer(name) if ENABLED else _NULL_TIMER
+
+def count(name, n=1):
+    """Add n to the named counter, e.g. of cache hits, while instrumentation is enabled."""
+    if not ENABLED:
+        return
+    with _LOCK:
+        _COUNTERS[name] = _COUNTERS.get(name, 0) + n
+
+def observe(name, value):
+    """Record a value of the named quantity, e.g. the rows scanned by a call, while instrumentation is enabled."""
+    if not ENABLED:
+        return
+    _add(_DISTRIBUTIONS, Distribution, name, value)
+
+class SamplingProfiler(object):
+    """Sample the main thread's stack every interval seconds of CPU time, counting each distinct stack."""
+    def __init__(self, interval=DEFAULT_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = {}
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('%s (%s:%s)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        key = ';'.join(reversed(stack))
+        self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def start(self):
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def write(self, file_name):
+        """Write the samples as folded stacks: one 'frame;frame;frame count' line per distinct stack."""
+        with open(file_name, 'w') as f:
+            for stack, n in sorted(self.stacks.iteritems()):
+                f.write('%s %s\n' % (stack, n))
+
+def enable(profile=False, interval=DEFAULT_SAMPLE_INTERVAL):
+    """Start recording, and with profile=True, start the sampling profiler."""
+    global ENABLED, _START_TIME, _PROFILER
+    ENABLED = True
+    if _START_TIME is None:
+        _START_TIME = time.time()
+    if profile and _PROFILER is None:
+        _PROFILER = SamplingProfiler(interval)
+        _PROFILER.start()
+
+def disable():
+    """Stop recording and profiling; what's been recorded is kept."""
+    global ENABLED
+    ENABLED = False
+    if _PROFILER is not None:
+        _PROFILER.stop()
+
+def reset():
+    global _START_TIME, _PROFILER
+    with _LOCK:
+        _TIMINGS.clear()
+        _DISTRIBUTIONS.clear()
+        _COUNTERS.clear()
+    _START_TIME = time.time() if ENABLED else None
+    if _PROFILER is not None:
+        _PROFILER.stop()
+        _PROFILER = None
+
+def summary():
+    """Return a dict summarizing everything recorded so far."""
+    with _LOCK:
+        return {
+            'command': ' '.join(sys.argv),
+            'pid': os.getpid(),
+            'seconds': time.time() - _START_TIME if _START_TIME else 0.0,
+            'timings': {name: timing.summary() for name, timing in _TIMINGS.iteritems()},
+            'distributions': {name: distribution.summary() for name, distribution in _DISTRIBUTIONS.iteritems()},
+            'counters': dict(_COUNTERS),
+        }
+
+def merge_summaries(summaries):
+    """Merge the summaries of several processes' runs into one, for the first of them."""
+    merged = dict(summaries[0])
+    merged['pids'] = sorted(s['pid'] for s in summaries)
+    merged['counters'] = {}
+    for s in summaries:
+        for name, n in s['counters'].iteritems():
+            merged['counters'][name] = merged['counters'].get(name, 0) + n
+
+    for key, distribution_class in [('timings', Timing), ('distributions', Distribution)]:
+        distributions = {}
+        for s in summaries:
+            for name, summary in s.get(key, {}).iteritems():
+                distributions.setdefault(name, distribution_class()).merge(summary)
+        merged[key] = {name: distribution.summary() for name, distribution in distributions.iteritems()}
+    return merged
+
+def print_summary():
+    s = summary()
+    print '%-45s %10s %12s %12s %12s %12s' % ('timing', 'calls', 'total (s)', 'mean (ms)', 'p50 (ms)', 'p99 (ms)')
+    for name, t in sorted(s['timings'].iteritems(), key=lambda x: x[1]['total'], reverse=True):
+        print '%-45s %10s %12.3f %12.3f %12.3f %12.3f' % (name, t['calls'], t['total'], t['mean'] * 1000, t['p50'] * 1000, t['p99'] * 1000)
+    if s['distributions']:
+        print
+        print '%-45s %10s %12s %12s %12s %12s' % ('distribution', 'calls', 'total', 'mean', 'p50', 'p99')
+    for name, d in sorted(s['distributions'].iteritems()):
+        print '%-45s %10s %12g %12g %12g %12g' % (name, d['calls'], d['total'], d['mean'], d['p50'], d['p99'])
+    for name, n in sorted(s['counters'].iteritems()):
+        print '%-45s %10s' % (name, n)
+
+def write_summary(file_name, s=None):
+    with open(file_name, 'w') as f:
+        json.dump(s or summary(), f, indent=1, sort_keys=True)
+
+def write_profile(file_name):
+    if _PROFILER is not None:
+        _PROFILER.write(file_name)
+
+def _worker_file_name(file_name, pid):
+    return '%s.%s' % (file_name, pid)
+
+def _read_worker_files(file_name):
+    """Return the contents of the files written by this run's workers next to the given file, deleting them."""
+    contents = []
+    for worker_file_name in glob(_worker_file_name(file_name, '*')):
+        # skip other files, and workers' files left by earlier runs
+        if not worker_file_name.rsplit('.', 1)[1].isdigit() or os.path.getmtime(worker_file_name) < _START_TIME:
+            continue
+        with open(worker_file_name, 'r') as f:
+            contents.append(f.read())
+        os.remove(worker_file_name)
+    return contents
+
+def init_worker():
+    """Start recording afresh in a worker process forked from an instrumented one, flushing its summary when it exits.
+
+    A multiprocessing Pool's workers flush through a finalizer, so this can be
+    the Pool's initializer, or be called from it; other workers should call
+    flush_worker() themselves before they exit.
+
+    """
+    if not ENABLED:
+        return
+    # what the parent recorded before the fork is the parent's to report
+    profile = _PROFILER is not None
+    reset()
+    enable(profile=profile)
+    Finalize(None, flush_worker, exitpriority=10)
+
+def flush_worker():
+    """Write a worker's summary, and profile if there is one, next to the main process's, for it to merge."""
+    if not ENABLED or not os.environ.get(SUMMARY_FILE_ENV_VAR):
+        return
+    write_summary(_worker_file_name(os.environ[SUMMARY_FILE_ENV_VAR], os.getpid()))
+    if os.environ.get(PROFILE_FILE_ENV_VAR):
+        write_profile(_worker_file_name(os.environ[PROFILE_FILE_ENV_VAR], os.getpid()))
+
+def _write_at_exit(summary_file, profile_file):
+    disable()
+    write_summary(summary_file, merge_summaries([summary()] + [json.loads(s) for s in _read_worker_files(summary_file)]))
+    if profile_file and _PROFILER is not None:
+        # folded stacks from several processes are merged by adding their counts
+        for contents in _read_worker_files(profile_file):
+            for line in contents.splitlines():
+                stack, n = line.rsplit(' ', 1)
+                _PROFILER.stacks[stack] = _PROFILER.stacks.get(stack, 0) + int(n)
+        write_profile(profile_file)
+
+if os.environ.get(SUMMARY_FILE_ENV_VAR):
+    enable(profile=bool(os.environ.get(PROFILE_FILE_ENV_VAR)))
+    atexit.register(_write_at_exit, os.environ[SUMMARY_FILE_ENV_VAR], os.environ.get(PROFILE_FILE_ENV_VAR))
@@ -0,0 +1,94 @@
+"""
+# A load test for recommender_service.py.
+
+Users and beers are sampled from the reviews .csv file, and a number of
+client threads send requests to the service's endpoints as fast as they are
+answered. Latency percentiles and throughput are reported per endpoint.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import urllib
+import urllib2
+
+import numpy as np
+import pandas as pd
+
+ENDPOINTS = ['recommend', 'predict', 'nearest']
+
+def make_url(base_url, endpoint, usernames, beer_ids):
+    if endpoint == 'recommend':
+        params = {'user': random.choice(usernames)}
+    elif endpoint == 'predict':
+        params = {'user': random.choice(usernames), 'beer': random.choice(beer_ids)}
+    else:
+        params = {'beer': random.choice(beer_ids)}
+    return '%s/%s?%s' % (base_url, endpoint, urllib.urlencode(params))
+
+def run_client(base_url, endpoints, usernames, beer_ids, deadline, results, lock):
+    latencies = {endpoint: [] for endpoint in endpoints}
+    errors = 0
+    versions = set()
+    while time.time() < deadline:
+        endpoint = random.choice(endpoints)
+        url = make_url(base_url, endpoint, usernames, beer_ids)
+
+        start = time.time()
+        try:
+            versions.add(json.loads(urllib2.urlopen(url).read())['version'])
+        except (urllib2.URLError, ValueError, KeyError):
+            errors += 1
+            continue
+        latencies[endpoint].append(time.time() - start)
+
+    with lock:
+        for endpoint in endpoints:
+            results['latencies'][endpoint].extend(latencies[endpoint])
+        results['errors'] += errors
+        results['versions'] |= versions
+
+def print_summary(name, latencies, elapsed):
+    if not latencies:
+        print '%-10s no successful requests' % name
+        return
+    latencies = np.array(latencies) * 1000.0
+    print '%-10s %8d requests  %8.1f QPS  p50 %8.1f ms  p99 %8.1f ms' % (
+        name, len(latencies), len(latencies) / elapsed, np.percentile(latencies, 50), np.percentile(latencies, 99))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the recommendation service')
+    parser.add_argument('reviews', help='The reviews .csv file the service was started with')
+    parser.add_argument('--url', default='http://localhost:8000', help='The base URL of the service')
+    parser.add_argument('-c', '--clients', type=int, default=8, help='Number of concurrent clients')
+    parser.add_argument('-d', '--duration', type=float, default=30.0, help='Length of the test in seconds')
+    parser.add_argument('-e', '--endpoints', nargs='+', choices=ENDPOINTS, default=ENDPOINTS, help='Endpoints to request')
+    parser.add_argument('--sample', type=int, default=1000, help='Number of users and of beers to sample')
+    args = parser.parse_args()
+
+    reviews_df = pd.read_csv(args.reviews, usecols=['username', 'beer_id', 'text'])
+    reviews_df = reviews_df[pd.notnull(reviews_df['username']) & pd.notnull(reviews_df['text'])]
+    usernames = list(reviews_df['username'].unique())
+    beer_ids = list(reviews_df['beer_id'].unique())
+    usernames = random.sample(usernames, min(args.sample, len(usernames)))
+    beer_ids = [int(b) for b in random.sample(beer_ids, min(args.sample, len(beer_ids)))]
+
+    print '[INFO] Running %s clients for %s seconds against %s' % (args.clients, args.duration, args.url)
+    results = {'latencies': {endpoint: [] for endpoint in args.endpoints}, 'errors': 0, 'versions': set()}
+    lock = threading.Lock()
+    start = time.time()
+    deadline = start + args.duration
+    threads = [threading.Thread(target=run_client, args=(args.url, args.endpoints, usernames, beer_ids, deadline, results, lock))
+               for _ in range(args.clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+
+    for endpoint in args.endpoints:
+        print_summary(endpoint, results['latencies'][endpoint], elapsed)
+    print_summary('all', sum(results['latencies'].values(), []), elapsed)
+    print '%s errors; similarity versions seen: %s' % (results['errors'], ', '.join(sorted(results['versions'])))
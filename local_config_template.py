@@ -13,3 +13,10 @@ BEER_SIM_DB_FILE_PATH = ''
 
 # the path to the sqlite3 database file of user similarities
 USER_SIM_DB_FILE_PATH = ''
+
+# the path to the directory holding the pre-tokenized review corpus (see corpus.py);
+# it is created the first time the notebook runs
+CORPUS_DIR_PATH = ''
+
+# the path to the directory in which trained per-user text models are stored (see model_store.py)
+MODEL_STORE_DIR_PATH = ''
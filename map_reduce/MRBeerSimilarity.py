@@ -5,7 +5,7 @@ from itertools import combinations
 
 from scipy.stats.stats import pearsonr
 
-class MRBeerSimilaritieyRJob):
+class MRBeerSimilarity(MRJob):
     def steps(self):
         return [
             self.mr(mapper=self.line_mapper, reducer=self.users_items_reducer),
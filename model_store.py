@@ -0,0 +1,340 @@
+"""
+# A persistent store of per-user text models.
+
+Training a SentenceModel for a user is by far the most expensive part of
+predicting a rating from text, so each user's model is trained once and its
+parameters are saved as float32 arrays. The store is a directory holding:
+
+* words.dat: the corpus word ids of each model's words, concatenated (int32)
+* params.dat: each model's theta followed by its phi, concatenated (float32)
+* index.db: a sqlite3 database with one row per user giving the offset of the
+  user's model in the two files, its number of words, the number of reviews
+  it was trained on, and the size and fingerprint of the corpus vocabulary
+  its word ids refer to
+
+A model's row is committed only after its data is written, and data past the
+last committed model is cut off when the store is opened, so a crash never
+leaves the index pointing at partial data. A model whose vocabulary doesn't
+match the corpus's is retrained rather than used. The store should only be
+open in one process at a time.
+
+Models are read lazily through memory maps, and the most recently used ones
+are kept in memory.
+"""
+
+from collections import OrderedDict
+import os
+from os import makedirs
+from os.path import exists, getsize, join
+from Queue import Queue
+import sqlite3
+import threading
+import traceback
+
+import numpy as np
+
+from constants import ASPECTS, RATINGS
+from sentence_model import SentenceModel
+
+WORDS_FILE_NAME = 'words.dat'
+PARAMS_FILE_NAME = 'params.dat'
+INDEX_FILE_NAME = 'index.db'
+
+WORD_DTYPE = np.int32
+PARAM_DTYPE = np.float32
+WORD_SIZE = np.dtype(WORD_DTYPE).itemsize
+PARAM_SIZE = np.dtype(PARAM_DTYPE).itemsize
+
+# the number of floats stored per word: one theta and len(RATINGS) phis per aspect
+PARAMS_PER_WORD = len(ASPECTS) * (1 + len(RATINGS))
+
+DEFAULT_CAPACITY = 100
+
+# one user's reviews are few enough that a pool of processes per model costs more than it saves
+DEFAULT_TRAIN_PROCESSES = 1
+
+class UserModel(object):
+    """The trained parameters of one user's text model.
+
+    word_ids are sorted corpus word ids; theta has shape (n_aspects, n_words)
+    and phi has shape (n_aspects, n_ratings, n_words), with columns in the
+    order of word_ids.
+
+    """
+    def __init__(self, word_ids, theta, phi, num_reviews):
+        self.word_ids = word_ids
+        self.theta = theta
+        self.phi = phi
+        self.num_reviews = num_reviews
+
+        self._best_ratings = None
+
+    def get_positions(self, word_ids):
+        """Return the columns of the given corpus word ids, dropping words the model doesn't know."""
+        word_ids = np.asarray(word_ids)
+        positions = np.searchsorted(self.word_ids, word_ids)
+        positions[positions == len(self.word_ids)] = 0
+        return positions[self.word_ids[positions] == word_ids] if len(self.word_ids) else positions[:0]
+
+    def get_sentence_prob(self, word_ids, rating_indices, aspect_index):
+        """Return the probability that a sentence describes the given aspect.
+
+        rating_indices gives the index into RATINGS of the review's rating for each aspect.
+
+        """
+        positions = self.get_positions(word_ids)
+        scores = self.theta[:, positions].sum(axis=1) \
+            + self.phi[np.arange(len(ASPECTS)), rating_indices][:, positions].sum(axis=1)
+
+        # subtract the max before exponentiating to avoid overflow
+        exp_scores = np.exp(scores - scores.max())
+        return exp_scores[aspect_index] / exp_scores.sum()
+
+    def get_best_ratings(self):
+        """Return an (n_aspects, n_words) array of the rating each word most strongly implies.
+
+        This only depends on phi, so it's computed once per model.
+
+        """
+        if self._best_ratings is None:
+            self._best_ratings = np.array(RATINGS)[self.phi.argmax(axis=1)]
+        return self._best_ratings
+
+    @classmethod
+    def from_sentence_model(cls, sentence_model, word_lookup, num_reviews):
+        """Convert a trained SentenceModel, mapping its words to corpus word ids with word_lookup."""
+        theta, phi = sentence_model.get_parameter_arrays()
+        word_ids = np.array([word_lookup[w] for w in sentence_model.words], dtype=WORD_DTYPE)
+
+        order = np.argsort(word_ids)
+        return cls(word_ids[order], theta[:, order].astype(PARAM_DTYPE), phi[:, :, order].astype(PARAM_DTYPE), num_reviews)
+
+class ModelStore(object):
+    """Trains, saves, and serves per-user text models.
+
+    Models are trained on the user's reviews in df, using the corpus for
+    their sentences. A user whose number of reviews has grown since their
+    model was trained is retrained by a background thread; until that
+    finishes, the old model is served.
+
+    """
+    def __init__(self, path, df, corpus, capacity=DEFAULT_CAPACITY, train_kwargs=None):
+        self.path = path
+        self.df = df
+        self.corpus = corpus
+        self.capacity = capacity
+        self.train_kwargs = dict(train_kwargs or {})
+        self.train_kwargs.setdefault('processes', DEFAULT_TRAIN_PROCESSES)
+
+        # cache statistics
+        self.hits = 0
+        self.misses = 0
+        self.num_trained = 0
+
+        if not exists(path):
+            makedirs(path)
+        self.words_file = join(path, WORDS_FILE_NAME)
+        self.params_file = join(path, PARAMS_FILE_NAME)
+        for file_name in [self.words_file, self.params_file]:
+            if not exists(file_name):
+                open(file_name, 'wb').close()
+
+        # the connection is shared with the background thread, so every use of it is under the lock
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(join(path, INDEX_FILE_NAME), check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS models (username text PRIMARY KEY, offset integer, num_words integer, num_reviews integer, "
+                                "vocabulary_size integer, vocabulary_fingerprint text)")
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(models)")]
+        for column, column_type in [('vocabulary_size', 'integer'), ('vocabulary_fingerprint', 'text')]:
+            # stores from before vocabularies were recorded; their models are retrained when next used
+            if column not in columns:
+                self.connection.execute("ALTER TABLE models ADD COLUMN %s %s" % (column, column_type))
+        self.connection.commit()
+        self._truncate_tails()
+
+        self.cache = OrderedDict()
+        self.review_counts = dict(df.groupby('username').size())
+
+        # an Event for each user whose model is being trained, set when it's done
+        self.training = {}
+
+        # users waiting to be retrained in the background
+        self.pending = set()
+        self.queue = Queue()
+        self.thread = threading.Thread(target=self._retrain_worker)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def get(self, username):
+        """Return the user's UserModel, training it first if it has never been trained or its vocabulary is out of date."""
+        with self.lock:
+            model = self.cache.pop(username, None)
+            if model is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                model = self._load(username)
+
+        if model is None:
+            model = self._train_and_save(username)
+        elif model.num_reviews < self.review_counts.get(username, 0):
+            self._schedule_retrain(username)
+
+        with self.lock:
+            self._cache(username, model)
+        return model
+
+    def update_reviews(self, df, corpus=None):
+        """Replace the reviews the models are trained on.
+
+        The corpus must have the text of every review in df; by default, the
+        current corpus is extended with the new reviews. Users that now have
+        more reviews than their saved model was trained on are retrained in the
+        background.
+
+        """
+        with self.lock:
+            if corpus is None:
+                corpus = self.corpus.extend(df)
+            else:
+                # cached models may use another vocabulary's word ids; they're checked again when they're loaded
+                self.cache.clear()
+            self.df = df
+            self.corpus = corpus
+            self.review_counts = dict(df.groupby('username').size())
+
+        with self.lock:
+            rows = self.connection.execute("SELECT username, num_reviews FROM models").fetchall()
+        for username, num_reviews in rows:
+            if num_reviews < self.review_counts.get(username, 0):
+                self._schedule_retrain(username)
+
+    def stats(self):
+        """Return a dict of cache statistics."""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+            'trained': self.num_trained,
+            'cached': len(self.cache),
+            'pending': len(self.pending),
+        }
+
+    def _cache(self, username, model):
+        """Put the model at the most recently used end of the cache, evicting the least recently used."""
+        self.cache.pop(username, None)
+        self.cache[username] = model
+        while len(self.cache) > self.capacity:
+            self.cache.popitem(last=False)
+
+    def _load(self, username):
+        """Memory-map the user's saved model, or return None if there isn't one."""
+        row = self.connection.execute("SELECT offset, num_words, num_reviews, vocabulary_size, vocabulary_fingerprint FROM models WHERE username=?",
+            (username,)).fetchone()
+        if row is None:
+            return None
+
+        offset, num_words, num_reviews, vocabulary_size, fingerprint = row
+        if vocabulary_size is None or vocabulary_size > len(self.corpus.vocabulary) \
+                or self.corpus.get_fingerprint(vocabulary_size) != fingerprint:
+            # the model's word ids are from another vocabulary, so it has to be retrained
+            return None
+
+        if num_words == 0:
+            return UserModel(np.zeros(0, dtype=WORD_DTYPE), np.zeros((len(ASPECTS), 0), dtype=PARAM_DTYPE),
+                np.zeros((len(ASPECTS), len(RATINGS), 0), dtype=PARAM_DTYPE), num_reviews)
+
+        word_ids = np.memmap(self.words_file, dtype=WORD_DTYPE, mode='r',
+            offset=offset * WORD_SIZE, shape=(num_words,))
+        params = np.memmap(self.params_file, dtype=PARAM_DTYPE, mode='r',
+            offset=offset * PARAMS_PER_WORD * PARAM_SIZE, shape=(num_words * PARAMS_PER_WORD,))
+
+        theta_size = len(ASPECTS) * num_words
+        theta = params[:theta_size].reshape(len(ASPECTS), num_words)
+        phi = params[theta_size:].reshape(len(ASPECTS), len(RATINGS), num_words)
+        return UserModel(word_ids, theta, phi, num_reviews)
+
+    def _train(self, username, df, corpus):
+        user_reviews = df[df['username'] == username]
+        sentence_model = SentenceModel(user_reviews, corpus=corpus)
+        sentence_model.train(**self.train_kwargs)
+        return UserModel.from_sentence_model(sentence_model, corpus.word_lookup, len(user_reviews))
+
+    def _train_and_save(self, username):
+        """Train and save the user's model, or if it's already being trained, wait for that instead."""
+        with self.lock:
+            training = self.training.get(username)
+            if training is None:
+                self.training[username] = threading.Event()
+                df, corpus = self.df, self.corpus
+
+        if training is not None:
+            training.wait()
+            with self.lock:
+                model = self._load(username)
+            # if that training failed, try again
+            return model if model is not None else self._train_and_save(username)
+
+        try:
+            model = self._train(username, df, corpus)
+            self._save(username, model, corpus)
+        finally:
+            with self.lock:
+                self.training.pop(username).set()
+        return model
+
+    def _save(self, username, model, corpus):
+        with self.lock:
+            # records are only ever appended; a retrained model's old record is left unreferenced
+            offset = getsize(self.words_file) / WORD_SIZE
+            try:
+                for file_name, arrays in [(self.words_file, [model.word_ids]), (self.params_file, [model.theta, model.phi])]:
+                    with open(file_name, 'ab') as f:
+                        for array in arrays:
+                            f.write(array.tostring())
+                        f.flush()
+                        os.fsync(f.fileno())
+            except:
+                self._truncate_tails()
+                raise
+
+            # the row goes in last, so that it only ever points at complete records
+            vocabulary_size = len(corpus.vocabulary)
+            self.connection.execute("INSERT OR REPLACE INTO models VALUES (?, ?, ?, ?, ?, ?)",
+                (username, offset, len(model.word_ids), model.num_reviews, vocabulary_size, corpus.get_fingerprint(vocabulary_size)))
+            self.connection.commit()
+
+            self.num_trained += 1
+            if username in self.cache:
+                self.cache[username] = model
+
+    def _truncate_tails(self):
+        """Cut off any data written after the last model in the index, e.g. by a save that never finished."""
+        with self.lock:
+            end = self.connection.execute("SELECT COALESCE(MAX(offset + num_words), 0) FROM models").fetchone()[0]
+            for file_name, size in [(self.words_file, end * WORD_SIZE), (self.params_file, end * PARAMS_PER_WORD * PARAM_SIZE)]:
+                if getsize(file_name) > size:
+                    with open(file_name, 'r+b') as f:
+                        f.truncate(size)
+
+    def _schedule_retrain(self, username):
+        with self.lock:
+            if username in self.pending:
+                return
+            self.pending.add(username)
+        self.queue.put(username)
+
+    def _retrain_worker(self):
+        while True:
+            username = self.queue.get()
+            try:
+                self._train_and_save(username)
+            except Exception:
+                # keep the thread going; the user is retried the next time they're scheduled
+                print '[ERROR] Retraining the text model of %s failed' % username
+                traceback.print_exc()
+            finally:
+                with self.lock:
+                    self.pending.discard(username)
+                self.queue.task_done()
@@ -0,0 +1,233 @@
+"""
+# Precomputed recommendations for the static website.
+
+Every user's top recommendations and every beer's nearest beers are computed
+by a pool of processes and written as gzip-compressed JSON shards that the
+website can fetch directly:
+
+* users/<shard>.json.gz: {username: [[beer_id, average], ...]}
+* beers/<shard>.json.gz: {beer_id: [[beer_id, similarity, support], ...]}
+
+An id's shard is the first two hex digits of the md5 of the id (as a UTF-8
+string), so a lookup fetches one small file. manifest.json records the
+parameters, the beer similarity database's version, each user's and beer's
+number of reviews, and the beers each user's recommendations were drawn from
+and among. When the job is run again with the same parameters and
+similarities, only what may have changed is recomputed, and only the shards
+holding it are rewritten:
+
+* a beer's nearest beers depend only on the similarities and the set of
+  beers, so they're recomputed only if beers have been added or removed;
+* a user's recommendations are recomputed if the user's number of reviews
+  has changed, or if one of the beers they depend on has a new number of
+  reviews (and so a new average) or new nearest beers.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+from multiprocessing import Pool, cpu_count
+from os import listdir, makedirs, rename, walk
+from os.path import exists, getsize, join
+import time
+
+import pandas as pd
+
+from constants import DEFAULT_K, DEFAULT_REG
+import instrumentation
+from recommender import precompute_averages, k_nearest, get_reco_candidates, rank_candidates
+from recommender import SQLBeerDatabase, get_file_version
+
+SHARD_DIGITS = 2
+USERS_DIR_NAME = 'users'
+BEERS_DIR_NAME = 'beers'
+MANIFEST_FILE_NAME = 'manifest.json'
+
+DEFAULT_NUM_RECOS = 10
+
+# the number of users or beers computed by a worker at a time
+CHUNK_SIZE = 100
+
+# the number of decimal places kept in the shards; more only make them bigger
+PRECISION = 4
+
+# the state shared with worker processes, set by _init_worker
+_WORKER = {}
+
+def get_shard(object_id):
+    """Return the name of the shard holding the given user or beer ID."""
+    return hashlib.md5(str(object_id)).hexdigest()[:SHARD_DIGITS]
+
+def _init_worker(df, beer_db_file_path, aspect, num_recos, k, reg):
+    instrumentation.init_worker()
+    _WORKER['df'] = df
+    _WORKER['beer_db'] = SQLBeerDatabase(beer_db_file_path)
+    _WORKER['unique_beer_ids'] = df['beer_id'].unique()
+    _WORKER['aspect'] = aspect
+    _WORKER['num_recos'] = num_recos
+    _WORKER['k'] = k
+    _WORKER['reg'] = reg
+
+def _recommend_chunk(usernames):
+    """Return (username, recommendations, the IDs of the beers they depend on) for each user."""
+    w = _WORKER
+    results = []
+    for username in usernames:
+        top_beer_ids, candidates = get_reco_candidates(username, w['aspect'], w['df'], w['beer_db'], w['num_recos'], k=w['k'], reg=w['reg'])
+        recos = [[int(beer_id), round(avg, PRECISION)] for beer_id, avg in rank_candidates(candidates, w['aspect'], w['df'], w['num_recos'])]
+        results.append((username, recos, sorted(int(beer_id) for beer_id in set(top_beer_ids) | candidates)))
+    return results
+
+def _nearest_chunk(beer_ids):
+    w = _WORKER
+    return [(str(beer_id), [[int(near_beer_id), round(sim, PRECISION), int(support)]
+                            for near_beer_id, sim, support in k_nearest(beer_id, w['unique_beer_ids'], w['aspect'], w['beer_db'], k=w['k'], reg=w['reg'])])
+            for beer_id in beer_ids]
+
+def _encode_keys(d):
+    """json returns unicode keys, but the IDs from the reviews are UTF-8 strings."""
+    return {key.encode('utf-8'): value for key, value in d.iteritems()}
+
+def read_shard(file_name):
+    if not exists(file_name):
+        return {}
+    with gzip.open(file_name, 'rb') as f:
+        return _encode_keys(json.loads(f.read()))
+
+def read_shards(path):
+    """Return the entries of every shard under path."""
+    entries = {}
+    if exists(path):
+        for file_name in listdir(path):
+            if file_name.endswith('.json.gz'):
+                entries.update(read_shard(join(path, file_name)))
+    return entries
+
+def write_shard(file_name, entries):
+    # write to a temporary file first so that the site never sees a partial shard
+    with gzip.open(file_name + '.tmp', 'wb') as f:
+        f.write(json.dumps(entries, separators=(',', ':'), sort_keys=True))
+    rename(file_name + '.tmp', file_name)
+
+def update_shards(path, results, removed=()):
+    """Merge (id, value) results into the shards under path, dropping removed IDs; return the number of shards written."""
+    if not exists(path):
+        makedirs(path)
+
+    by_shard = {}
+    for object_id, value in results:
+        by_shard.setdefault(get_shard(object_id), {})[object_id] = value
+    removed_by_shard = {}
+    for object_id in removed:
+        removed_by_shard.setdefault(get_shard(object_id), []).append(object_id)
+
+    shards = set(by_shard) | set(removed_by_shard)
+    for shard in shards:
+        file_name = join(path, shard + '.json.gz')
+        entries = read_shard(file_name)
+        entries.update(by_shard.get(shard, {}))
+        for object_id in removed_by_shard.get(shard, []):
+            entries.pop(object_id, None)
+        write_shard(file_name, entries)
+
+    return len(shards)
+
+def _chunks(ids):
+    return [ids[i:i + CHUNK_SIZE] for i in range(0, len(ids), CHUNK_SIZE)]
+
+def get_changed(counts, previous_counts):
+    """Return the IDs whose review counts differ from the previous ones, and the IDs that no longer have reviews."""
+    changed = [object_id for object_id, count in counts.iteritems() if previous_counts.get(object_id) != count]
+    removed = [object_id for object_id in previous_counts if object_id not in counts]
+    return changed, removed
+
+def get_directory_size(path):
+    return sum(getsize(join(directory, f)) for directory, _, files in walk(path) for f in files)
+
+def generate(df, beer_db_file_path, dest, aspect='overall', num_recos=DEFAULT_NUM_RECOS, k=DEFAULT_K, reg=DEFAULT_REG,
+             processes=None, full=False):
+    """Compute and write the shards for every user and beer in df whose lists may have changed since the last run.
+
+    With full=True, or if the parameters or similarities have changed, everything is recomputed.
+
+    """
+    parameters = {'aspect': aspect, 'num_recos': num_recos, 'k': k, 'reg': reg, 'version': get_file_version(beer_db_file_path)}
+
+    manifest_file = join(dest, MANIFEST_FILE_NAME)
+    manifest = None
+    if not full and exists(manifest_file):
+        with open(manifest_file, 'r') as f:
+            manifest = json.load(f)
+        if manifest['parameters'] != parameters:
+            print '[INFO] Parameters or similarities have changed; regenerating everything'
+            manifest = None
+
+    user_counts = {username: int(n) for username, n in df.groupby('username').size().iteritems()}
+    beer_counts = {str(beer_id): int(n) for beer_id, n in df.groupby('beer_id').size().iteritems()}
+    previous_beer_counts = _encode_keys(manifest['beer_counts']) if manifest else {}
+    users, removed_users = get_changed(user_counts, _encode_keys(manifest['user_counts']) if manifest else {})
+    changed_beers, removed_beers = get_changed(beer_counts, previous_beer_counts)
+    user_beers = _encode_keys(manifest['user_beers']) if manifest else {}
+    for username in removed_users:
+        user_beers.pop(username, None)
+
+    # the nearest beers are searched for among all the beers, so they change only if the set of beers does
+    beers = sorted(beer_counts) if manifest is None or set(beer_counts) != set(previous_beer_counts) else []
+
+    start = time.time()
+    precompute_averages(df)
+    pool = Pool(processes or cpu_count(), initializer=_init_worker, initargs=(df, beer_db_file_path, aspect, num_recos, k, reg))
+    try:
+        print '[INFO] Computing nearest beers for %s beers' % len(beers)
+        beer_results = [r for chunk in pool.map(_nearest_chunk, _chunks([int(b) for b in beers])) for r in chunk]
+
+        if manifest is not None:
+            previous_nearest = read_shards(join(dest, BEERS_DIR_NAME))
+            changed_nearest = [beer_id for beer_id, nearest in beer_results if previous_nearest.get(beer_id) != nearest]
+            changed_beer_ids = set(int(beer_id) for beer_id in changed_beers + removed_beers + changed_nearest)
+            changed_users = set(users)
+            users += [username for username, beer_ids in user_beers.iteritems()
+                      if username not in changed_users and changed_beer_ids.intersection(beer_ids)]
+
+        print '[INFO] Computing recommendations for %s users' % len(users)
+        user_results = [r for chunk in pool.map(_recommend_chunk, _chunks(users)) for r in chunk]
+    finally:
+        pool.close()
+        pool.join()
+    compute_time = time.time() - start
+
+    num_shards = update_shards(join(dest, USERS_DIR_NAME), [(username, recos) for username, recos, _ in user_results], removed_users)
+    num_shards += update_shards(join(dest, BEERS_DIR_NAME), beer_results, removed_beers)
+    user_beers.update((username, beer_ids) for username, _, beer_ids in user_results)
+
+    with open(manifest_file + '.tmp', 'w') as f:
+        json.dump({'parameters': parameters, 'user_counts': user_counts, 'beer_counts': beer_counts, 'user_beers': user_beers}, f)
+    rename(manifest_file + '.tmp', manifest_file)
+
+    total_time = time.time() - start
+    num_computed = len(users) + len(beers)
+    print '[INFO] Computed %s lists in %.1f s (%.1f per second); wrote %s shards in %.1f s' % (
+        num_computed, compute_time, num_computed / compute_time if compute_time else 0.0, num_shards, total_time - compute_time)
+    print '[INFO] Total output size: %.1f KB' % (get_directory_size(dest) / 1024.0)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precompute recommendation shards for the website')
+    parser.add_argument('reviews', help='The reviews .csv file')
+    parser.add_argument('beer_db', help='The sqlite3 database file of beer similarities')
+    parser.add_argument('dest', help='Directory to which to write the shards')
+    parser.add_argument('-n', '--num-recos', type=int, default=DEFAULT_NUM_RECOS, help='Number of recommendations per user')
+    parser.add_argument('-k', type=int, default=DEFAULT_K, help='Number of nearest beers')
+    parser.add_argument('-r', '--reg', type=float, default=DEFAULT_REG, help='Similarity shrinkage regularizer')
+    parser.add_argument('-a', '--aspect', default='overall', help='Aspect by which to rank')
+    parser.add_argument('-p', '--processes', type=int, default=None, help='Number of processes to use')
+    parser.add_argument('--full', action='store_true', help='Regenerate every shard rather than only those with new reviews')
+    args = parser.parse_args()
+
+    # use the same reviews as the recommender: those with a username and a text review
+    reviews_df = pd.read_csv(args.reviews)
+    reviews_df = reviews_df[pd.notnull(reviews_df['username'])]
+    reviews_df = reviews_df[pd.notnull(reviews_df['text'])]
+
+    generate(reviews_df, args.beer_db, args.dest, aspect=args.aspect, num_recos=args.num_recos, k=args.k, reg=args.reg,
+             processes=args.processes, full=args.full)
@@ -0,0 +1,461 @@
+"""
+# The collaborative filtering recommender.
+
+These are the building blocks used by Recommender.ipynb. They live in a
+module so that long-running processes (e.g. recommender_service.py) can
+share them with the notebook.
+"""
+
+import os
+import sqlite3
+import threading
+
+import numpy as np
+from scipy.stats.stats import pearsonr
+
+from constants import DEFAULT_K, DEFAULT_REG, DEFAULT_ASPECT_REG_PARAM, ASPECTS, ASPECTS_MINUS_OVERALL
+from exploration_stats import get_user_beer_matrix, get_common_support_counts, DEFAULT_BLOCK_SIZE
+from instrumentation import instrumented, count, observe
+
+##################
+# Aspect weights #
+##################
+
+def normalize(a):
+    s = float(sum(a))
+    if s == 0.0:
+        return a
+
+    return [0.0 if x == 0.0 else float(x) / s for x in a]
+
+# cache aspect weights so we don't continually re-compute them for the same users
+CACHED_ASPECT_WEIGHTS = {}
+
+@instrumented('get_aspect_weights')
+def get_aspect_weights(username, df, reg=DEFAULT_ASPECT_REG_PARAM):
+    if username in CACHED_ASPECT_WEIGHTS:
+        count('CACHED_ASPECT_WEIGHTS.hits')
+        return CACHED_ASPECT_WEIGHTS[username]
+    count('CACHED_ASPECT_WEIGHTS.misses')
+
+    user_reviews = df[df['username'] == username]
+    observe('get_aspect_weights.rows_scanned', len(df))
+    overall_ratings = user_reviews['overall']
+
+    weights = [shrunk_sim(pearsonr(user_reviews[aspect], overall_ratings)[0], float(len(user_reviews)), reg) for aspect in ASPECTS_MINUS_OVERALL]
+    CACHED_ASPECT_WEIGHTS[username] = normalize(weights)
+
+    return CACHED_ASPECT_WEIGHTS[username]
+
+def precompute_aspect_weights(df, reg=DEFAULT_ASPECT_REG_PARAM):
+    """Fill the aspect weight cache for every user, grouping the reviews once rather than filtering per user."""
+    for username, user_reviews in df.groupby('username'):
+        if username not in CACHED_ASPECT_WEIGHTS:
+            get_aspect_weights(username, user_reviews, reg=reg)
+
+############################
+# Data filtering functions #
+############################
+
+# used to cache user and beer averages so we don't have to re-compute them
+USER_AVERAGES = {}
+BEER_AVERAGES = {}
+
+def get_user_averages(df, rating_col_name):
+    return dict(df.groupby('username')[rating_col_name].mean())
+
+@instrumented('get_single_user_average')
+def get_single_user_average(df, username, aspect):
+    if username in USER_AVERAGES:
+        if aspect in USER_AVERAGES[username]:
+            count('USER_AVERAGES.hits')
+            return USER_AVERAGES[username][aspect]
+    else:
+        USER_AVERAGES[username] = {}
+    count('USER_AVERAGES.misses')
+
+    USER_AVERAGES[username][aspect] = df[df.username == username][aspect].mean()
+    observe('get_single_user_average.rows_scanned', len(df))
+    return USER_AVERAGES[username][aspect]
+
+def get_beer_averages(df, rating_col_name):
+    return dict(df.groupby('beer_id')[rating_col_name].mean())
+
+@instrumented('get_single_beer_average')
+def get_single_beer_average(df, beer_id, aspect):
+    if beer_id in BEER_AVERAGES:
+        if aspect in BEER_AVERAGES[beer_id]:
+            count('BEER_AVERAGES.hits')
+            return BEER_AVERAGES[beer_id][aspect]
+    else:
+        BEER_AVERAGES[beer_id] = {}
+    count('BEER_AVERAGES.misses')
+
+    BEER_AVERAGES[beer_id][aspect] = df[df.beer_id == beer_id][aspect].mean()
+    observe('get_single_beer_average.rows_scanned', len(df))
+    return BEER_AVERAGES[beer_id][aspect]
+
+def precompute_averages(df):
+    """Fill the user and beer average caches for every user, beer, and aspect in one pass each."""
+    for aspect in ASPECTS:
+        for username, avg in get_user_averages(df, aspect).iteritems():
+            USER_AVERAGES.setdefault(username, {})[aspect] = avg
+        for beer_id, avg in get_beer_averages(df, aspect).iteritems():
+            BEER_AVERAGES.setdefault(beer_id, {})[aspect] = avg
+
+def invalidate_averages(usernames=(), beer_ids=()):
+    """Forget the cached averages and aspect weights of users and beers whose reviews have changed."""
+    for username in usernames:
+        USER_AVERAGES.pop(username, None)
+        CACHED_ASPECT_WEIGHTS.pop(username, None)
+    for beer_id in beer_ids:
+        BEER_AVERAGES.pop(beer_id, None)
+    GLOBAL_AVG.clear()
+
+def get_user_reviewed(username, df):
+    observe('get_user_reviewed.rows_scanned', len(df))
+    return set(df[df['username'] == username]['beer_id'])
+
+def get_beer_reviewers(beer_id, df):
+    return set(df[df['beer_id'] == beer_id]['username'])
+
+def get_user_top_rated(username, rating_col_name, df, numchoices=5):
+    "Return the sorted top numchoices beers for a user by the given rating column name."
+    return df[df['username'] == username][['beer_id', rating_col_name]].sort_values(rating_col_name, ascending=False).head(numchoices)
+
+#########################################################
+# Define functions used for common support calculations #
+#########################################################
+
+def get_common_reviewers(beer_id_1, beer_id_2, df):
+    beer_1_reviewers = df[df['beer_id'] == beer_id_1]['username'].unique()
+    beer_2_reviewers = df[df['beer_id'] == beer_id_2]['username'].unique()
+    return set(beer_1_reviewers).intersection(beer_2_reviewers)
+
+def get_common_reviewed(username_1, username_2, df):
+    user_1_reviewed = df[df['username'] == username_1]['beer_id'].unique()
+    user_2_reviewed = df[df['username'] == username_2]['beer_id'].unique()
+    return set(user_1_reviewed).intersection(user_2_reviewed)
+
+def get_common_support(df, block_size=DEFAULT_BLOCK_SIZE):
+    """Return counts such that counts[s] is the number of pairs of beers that s users reviewed in common.
+
+    The supports come from the sparse user-by-beer matrix (see
+    exploration_stats.py) rather than from the common reviewers of every pair.
+
+    """
+    matrix, _, _ = get_user_beer_matrix(df)
+    return get_common_support_counts(matrix, block_size)
+
+def get_reviews_for_beer_and_users(beer_id, user_set, df):
+    """Given a beer ID and a set of usernames, return the sub-dataframe of the users' reviews of the beer."""
+    mask = (df['username'].isin(user_set)) & (df['beer_id'] == beer_id)
+    reviews = df[mask]
+    return reviews[reviews['username'].duplicated() == False]
+
+def get_reviews_for_user_and_beers(username, beer_set, df):
+    """Given a username and a set of beer IDs, return the sub-dataframe of the user's reviews of the beers."""
+    mask = (df['beer_id'].isin(beer_set)) & (df['username'] == username)
+    reviews = df[mask]
+    return reviews[reviews['beer_id'].duplicated() == False]
+
+####################################
+# Similarity calculation functions #
+####################################
+
+def pearson_sim(reviews_df_1, reviews_df_2, averages, num_common, rating_col_name, avg_lookup_col_name):
+    """
+    Given 2 subframes of reviews, return the Pearson correlation coefficient between the reviews.
+
+    * Also subtract an average rating value from the reviews before calculating correlation.
+    * If there is no common support between the review sets, return 0.
+    * If varainces are 0, NaN may be returned.
+    """
+    if num_common == 0:
+        return 0.0
+
+    diff1 = reviews_df_1.apply(lambda x: x[rating_col_name] - averages[x[avg_lookup_col_name]], axis=1)
+    diff2 = reviews_df_2.apply(lambda x: x[rating_col_name] - averages[x[avg_lookup_col_name]], axis=1)
+    return pearsonr(diff1, diff2)[0]
+
+def calculate_beer_similarity(beer_id_1, beer_id_2, user_averages, similarity_func, rating_col_name, df):
+    common_reviewers = get_common_reviewers(beer_id_1, beer_id_2, df)
+    beer_1_reviews = get_reviews_for_beer_and_users(beer_id_1, common_reviewers, df)
+    beer_2_reviews = get_reviews_for_beer_and_users(beer_id_2, common_reviewers, df)
+    sim = similarity_func(beer_1_reviews, beer_2_reviews, user_averages, len(common_reviewers), rating_col_name, 'username')
+    return (0.0 if np.isnan(sim) else sim, len(common_reviewers))
+
+def calculate_user_similarity(username_1, username_2, beer_averages, similarity_func, rating_col_name, df):
+    common_beers = get_common_reviewed(username_1, username_2, df)
+    user_1_reviews = get_reviews_for_user_and_beers(username_1, common_beers, df)
+    user_2_reviews = get_reviews_for_user_and_beers(username_2, common_beers, df)
+    sim = similarity_func(user_1_reviews, user_2_reviews, beer_averages, len(common_beers), rating_col_name, 'beer_id')
+    return (0.0 if np.isnan(sim) else sim, len(common_beers))
+
+def shrunk_sim(sim, n_common, reg=DEFAULT_REG):
+    "Shrink the similarity with the regularizer."
+    return (n_common * sim) / (n_common + reg)
+
+##################################################
+# Functions for k-nearest neighbors calculations #
+##################################################
+
+@instrumented('k_nearest')
+def k_nearest(object_id, search_set, aspect, db, k=DEFAULT_K, reg=DEFAULT_REG):
+    observe('k_nearest.candidates', len(search_set))
+    similar = []
+    for current_object_id in search_set:
+        if current_object_id != object_id:
+            sim, support = db.get(object_id, current_object_id, aspect)
+            similar.append((current_object_id, shrunk_sim(sim, support, reg=reg), support))
+    similar.sort(key=lambda x: x[1], reverse=True)
+    return similar[:k]
+
+############################
+# Recommendation functions #
+############################
+
+def get_reco_candidates(username, rating_col_name, df, db, n, k=DEFAULT_K, reg=DEFAULT_REG):
+    """Return the user's top-rated beers, and the set of beers near them that the user hasn't reviewed.
+
+    get_top_recos_for_user ranks the latter by their averages, so a user's
+    recommendations depend on the nearest beers of the former and the
+    reviews of the latter.
+
+    """
+    # we'll get similar beers from all those in the dataset
+    unique_beer_ids = df['beer_id'].unique()
+
+    top_beer_ids = list(get_user_top_rated(username, rating_col_name, df, numchoices=n)['beer_id'])
+    neighbors = set()
+
+    # for each of the user's top-rated beers...
+    for top_beer_id in top_beer_ids:
+        # ...get similar beers
+        for near_beer_id, _, _ in k_nearest(top_beer_id, unique_beer_ids, rating_col_name, db, k=k, reg=reg):
+            neighbors.add(near_beer_id)
+
+    # only use beers that the user has not reviewed
+    return top_beer_ids, neighbors - get_user_reviewed(username, df)
+
+def rank_candidates(candidates, rating_col_name, df, n):
+    "Return (beer_id, average) pairs for the n candidate beers with the highest averages."
+    result = [(beer_id, get_single_beer_average(df, beer_id, rating_col_name)) for beer_id in candidates]
+    return sorted(result, key=lambda x: x[1], reverse=True)[:n]
+
+def get_top_recos_for_user(username, rating_col_name, df, db, n, k=DEFAULT_K, reg=DEFAULT_REG):
+    _, candidates = get_reco_candidates(username, rating_col_name, df, db, n, k=k, reg=reg)
+    return rank_candidates(candidates, rating_col_name, df, n)
+
+############################
+# Aspect rating prediction #
+############################
+
+# global averages, computed the first time they're needed
+GLOBAL_AVG = {}
+
+def get_global_average(df, aspect):
+    if aspect not in GLOBAL_AVG:
+        observe('get_global_average.rows_scanned', len(df))
+        GLOBAL_AVG[aspect] = df[aspect].mean()
+    return GLOBAL_AVG[aspect]
+
+def baseline(global_avg, user_avg, beer_avg):
+    return global_avg + (user_avg - global_avg) + (beer_avg - global_avg)
+
+@instrumented('predict_aspect_rating')
+def predict_aspect_rating(beer_id, username, aspect, beer_db, user_db, df, k=DEFAULT_K, reg=DEFAULT_REG, neighbors=None):
+    """Predict the user's rating of the beer for the aspect.
+
+    If neighbors is a (usernames, beer_ids) pair of sets, the users and beers
+    whose reviews the prediction draws on, other than username's and
+    beer_id's, are added to them.
+
+    """
+    BEER = 0
+    USER = 1
+
+    global_avg = get_global_average(df, aspect)
+    beer_avg = get_single_beer_average(df, beer_id, aspect)
+    user_avg = get_single_user_average(df, username, aspect)
+
+    nearest_beers = k_nearest(beer_id, get_user_reviewed(username, df), aspect, beer_db, k=k, reg=reg)
+
+    # get k nearest users who have reviewed this beer
+    rows_scanned = len(df)
+    nearest_users = k_nearest(username, df[df['beer_id'] == beer_id]['username'].unique(), aspect, user_db, k=k, reg=reg)
+
+    # k_nearest has already shrunk the similarities
+    nearest = []
+    for beer, sim, support in nearest_beers:
+        nearest.append((BEER, beer, sim, support))
+    for user, sim, support in nearest_users:
+        nearest.append((USER, user, sim, support))
+
+    nearest.sort(key=lambda x: abs(x[2]), reverse=True)
+
+    num = 0.0
+    denom = 0.0
+    for id_type, object_id, sim, support in nearest[:k]:
+        if neighbors is not None:
+            usernames, beer_ids = neighbors
+            (beer_ids if id_type == BEER else usernames).add(object_id)
+
+        if id_type == BEER:
+            # get the user's review of the similar beer
+            reviews = df[(df['username'] == username) & (df['beer_id'] == object_id)]
+            rows_scanned += len(df)
+            assert(reviews.shape[0] == 1)
+
+            # get average for the similar beer
+            similar_beer_avg = get_single_beer_average(df, object_id, aspect)
+
+            num += sim * (float(reviews.iloc[0][aspect]) - baseline(global_avg, user_avg, similar_beer_avg))
+            denom += abs(sim)
+        elif id_type == USER:
+            # get the similar user's review of the beer
+            reviews = df[(df['username'] == object_id) & (df['beer_id'] == beer_id)]
+            rows_scanned += len(df)
+            assert(reviews.shape[0] == 1)
+
+            # get average for the similar user
+            similar_user_avg = get_single_user_average(df, object_id, aspect)
+
+            num += sim * (float(reviews.iloc[0][aspect]) - baseline(global_avg, similar_user_avg, beer_avg))
+            denom += abs(sim)
+    observe('predict_aspect_rating.rows_scanned', rows_scanned)
+
+    if denom != 0:
+        return baseline(global_avg, user_avg, beer_avg) + num / denom
+    else:
+        return baseline(global_avg, user_avg, beer_avg)
+
+def predict_overall_rating(beer_id, username, beer_db, user_db, df, k=DEFAULT_K, reg=DEFAULT_REG, neighbors=None):
+    aspect_ratings = []
+    for aspect in ASPECTS_MINUS_OVERALL:
+        aspect_ratings.append(
+            predict_aspect_rating(beer_id, username, aspect, beer_db, user_db, df, k=k, reg=reg, neighbors=neighbors))
+
+    user_aspect_weights = get_aspect_weights(username, df)
+
+    return np.array(aspect_ratings).dot(user_aspect_weights)
+
+########################
+# Similarity databases #
+########################
+
+class Database(object):
+    """A class representing a database of similaries and common supports."""
+    def __init__(self, df, id_col, average_function):
+        self.df = df
+        self.average_function = average_function
+
+        self.id_col = id_col
+        self.opposite_id_col = None
+        if id_col == 'beer_id':
+            self.opposite_id_col = 'username'
+        else:
+            self.opposite_id_col = 'beer_id'
+
+        self.unique_ids = {v: k for (k, v) in enumerate(df[id_col].unique())}
+        keys = self.unique_ids.keys()
+        num_keys = len(keys)
+        self.similarities = np.zeros([num_keys, num_keys])
+        self.supports = np.zeros([num_keys, num_keys], dtype=np.int)
+
+    def calculate_similarity(self, id_1, id_2, averages, similarity_func, rating_col_name, df):
+        raise NotImplementedError
+
+    def populate_by_calculating(self, similarity_func, rating_col_name):
+        averages = self.average_function(self.df, rating_col_name)
+        items = self.unique_ids.items()
+
+        count = 0
+        for id_1, i in items:
+            print '%s (i = %s)' % (count, i)
+            count += 1
+            for id_2, j in items:
+                if i < j:
+                    sim, nsup = self.calculate_similarity(id_1, id_2, averages, similarity_func, rating_col_name, self.df)
+                    self.similarities[i][j] = sim
+                    self.similarities[j][i] = sim
+                    self.supports[i][j] = nsup
+                    self.supports[j][i] = nsup
+                elif i == j:
+                    nsup = self.df[self.df[self.id_col] == id_1][self.opposite_id_col].count()
+                    self.similarities[i][i] = 1.0
+                    self.supports[i][i] = nsup
+
+    def get(self, id_1, id_2, aspect=None):
+        """Return a (similarity, common_support) tuple for the given IDs.
+
+        The database holds similarities for a single rating column, so aspect is ignored;
+        it's accepted so that this can be used interchangeably with SQLDatabase.
+
+        """
+        return (
+            self.similarities[self.unique_ids[id_1]][self.unique_ids[id_2]],
+            self.supports[self.unique_ids[id_1]][self.unique_ids[id_2]]
+        )
+
+class BeerDatabase(Database):
+    def __init__(self, df):
+        super(BeerDatabase, self).__init__(df, 'beer_id', get_user_averages)
+        self.calculate_similarity = calculate_beer_similarity
+
+class UserDatabase(Database):
+    def __init__(self, df):
+        super(UserDatabase, self).__init__(df, 'username', get_beer_averages)
+        self.calculate_similarity = calculate_user_similarity
+
+
+"""
+# The classes below retrieve similarities from sqlite3 databases of beer and user similarities.
+"""
+
+def get_file_version(file_path):
+    """Return a string identifying the current contents of a file: its inode, size, and modification time in microseconds.
+
+    Databases are replaced by moving a new file over the old one, which
+    changes the inode, so even a file of the same size written within the
+    same second gets a new version.
+
+    """
+    stat = os.stat(file_path)
+    return '%x-%x-%x' % (stat.st_ino, stat.st_size, int(stat.st_mtime * 1e6))
+
+class SQLDatabase(object):
+    """Similarities stored in a sqlite3 database file, as written by map_reduce/mr_result_parser.py.
+
+    Each thread gets its own connection, since sqlite3 connections can't be shared between threads.
+
+    """
+    def __init__(self, db_file_path):
+        self.db_file_path = db_file_path
+        self.local = threading.local()
+
+    @property
+    def cursor(self):
+        if not hasattr(self.local, 'cursor'):
+            self.local.cursor = sqlite3.connect(self.db_file_path).cursor()
+        return self.local.cursor
+
+    @instrumented('SQLDatabase.get')
+    def get(self, object_id_1, object_id_2, aspect):
+        "Return a (similarity, common_support) tuple for the given IDs; pairs with no common support aren't stored."
+        if aspect not in ASPECTS:
+            raise Exception('Unknown aspect: %s' % aspect)
+
+        # we need to sort the object IDs because the database has one row
+        # for each object pair, indexed by the *sorted* pair
+        object_id_1, object_id_2 = sorted((str(object_id_1), str(object_id_2)))
+
+        row = self.cursor.execute("SELECT %s, support FROM similarities WHERE object_id_1=? AND object_id_2=?" % aspect, (object_id_1, object_id_2)).fetchone()
+        count('SQLDatabase.rows_found' if row else 'SQLDatabase.rows_missing')
+        return row if row else (0.0, 0)
+
+class SQLBeerDatabase(SQLDatabase):
+    pass
+
+class SQLUserDatabase(SQLDatabase):
+    pass
@@ -0,0 +1,455 @@
+"""
+# A long-running recommendation service.
+
+The reviews, the baseline averages, and the similarity databases are loaded
+once, and recommendations are served as JSON over local HTTP:
+
+* GET /recommend?user=<username>[&n=5][&k=7][&reg=3.0][&aspect=overall]
+* GET /predict?user=<username>&beer=<beer_id>[&aspect=<aspect>][&k=7][&reg=3.0]
+  (without an aspect, the overall rating is predicted from the user's aspect weights)
+* GET /nearest?beer=<beer_id>[&k=7][&reg=3.0][&aspect=overall]
+* GET /complete?q=<prefix>[&n=10]
+  (beer names starting with the prefix, for autocomplete; needs --beers)
+* GET /stats
+* POST /reload
+* POST /invalidate?user=<username>&beer=<beer_id>...
+  (after the reviews file has been updated: drop the cached results that
+  depend on the given users' and beers' reviews, and reload the reviews)
+
+Requests are handled by a pool of worker processes forked after everything
+is loaded, so they share the data and accept connections from the same
+socket; a worker that dies is replaced. Every response includes the version
+of the similarity snapshot it was computed from.
+
+The similarity databases can be replaced while the service runs: write the
+new database files elsewhere, move them over the old ones, then POST /reload
+or send the service SIGHUP. Each worker opens the new files before dropping
+the old ones, so no request goes unserved; if the new files can't be opened,
+the error is logged and the old ones stay in use.
+
+Results are cached (see result_cache.py) under keys that include the
+snapshot version and the version of the reviews file the service started
+with; changes to the reviews since are tracked by invalidation. The workers
+share the cache through a sqlite3 file, which is temporary unless
+--cache-file is given. A worker that sees an invalidation reloads the reviews
+before serving its next request.
+"""
+
+import argparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import json
+import errno
+from multiprocessing import cpu_count
+import os
+from os.path import join
+import signal
+import tempfile
+import time
+import traceback
+from urlparse import parse_qs, urlparse
+
+import pandas as pd
+
+from catalog import Catalog, DEFAULT_NUM_COMPLETIONS
+import instrumentation
+from constants import DEFAULT_K, DEFAULT_REG, ASPECTS
+from recommender import precompute_averages, precompute_aspect_weights
+from recommender import k_nearest, get_reco_candidates, rank_candidates, predict_aspect_rating, predict_overall_rating
+from recommender import SQLBeerDatabase, SQLUserDatabase, get_file_version
+from result_cache import ResultCache, DEFAULT_CAPACITY
+
+DEFAULT_PORT = 8000
+DEFAULT_NUM_RECOS = 5
+
+# a worker that dies sooner than this after starting is respawned only after this many seconds, so a crash loop doesn't spin
+RESPAWN_DELAY = 1.0
+
+class Snapshot(object):
+    """The beer and user similarity databases, and a version identifying their files."""
+    def __init__(self, beer_db_file_path, user_db_file_path):
+        self.beer_db = SQLBeerDatabase(beer_db_file_path)
+        self.user_db = SQLUserDatabase(user_db_file_path)
+        self.version = '%s.%s' % (get_file_version(beer_db_file_path), get_file_version(user_db_file_path))
+
+class RequestError(Exception):
+    def __init__(self, code, message):
+        super(RequestError, self).__init__(message)
+        self.code = code
+
+class RecommendationServer(HTTPServer):
+    # the socket is shared by the workers, so let it queue plenty of connections
+    request_queue_size = 128
+    verbose = False
+    # the Catalog of beer names, if the service was given the beers
+    catalog = None
+
+    def __init__(self, server_address, reviews_file_path, beer_db_file_path, user_db_file_path, cache_file_path,
+                 cache_capacity=DEFAULT_CAPACITY, cache_ttl=None):
+        HTTPServer.__init__(self, server_address, RecommendationHandler)
+        self.reviews_file_path = reviews_file_path
+        self.reviews_file_version = None
+        self.load_reviews()
+        # cache keys include the version the service started with; later changes are invalidated explicitly
+        self.reviews_version = self.reviews_file_version
+        # the cache generation the reviews are current with, once a worker has opened the cache
+        self.reviews_generation = None
+
+        self.cache_file_path = cache_file_path
+        self.cache_capacity = cache_capacity
+        self.cache_ttl = cache_ttl
+        self.cache = None
+        self.beer_db_file_path = beer_db_file_path
+        self.user_db_file_path = user_db_file_path
+        self.snapshot = Snapshot(beer_db_file_path, user_db_file_path)
+
+        self.start_time = time.time()
+        self.num_requests = 0
+        self.num_reloads = 0
+
+    def open_cache(self):
+        """Open the result cache; each worker opens its own, since sqlite3 connections can't cross a fork."""
+        self.cache = ResultCache(capacity=self.cache_capacity, ttl=self.cache_ttl, path=self.cache_file_path)
+        # a replacement worker may have been forked with reviews that have since been invalidated
+        self.sync_reviews()
+
+    def load_reviews(self):
+        """Load the reviews, unless the file hasn't changed since they were last loaded."""
+        version = get_file_version(self.reviews_file_path)
+        if version == self.reviews_file_version:
+            return
+        if self.reviews_file_version is not None:
+            print '[INFO] Process %s reloading reviews from %s' % (os.getpid(), self.reviews_file_path)
+        self.df = load_reviews(self.reviews_file_path)
+        self.unique_beer_ids = self.df['beer_id'].unique()
+        self.usernames = set(self.df['username'].unique())
+        self.beer_ids = set(self.unique_beer_ids)
+        self.reviews_file_version = version
+
+    def sync_reviews(self):
+        """Reload the reviews if anything has been invalidated since they were loaded; return the cache generation they're current with."""
+        generation = self.cache.generation()
+        if generation != self.reviews_generation:
+            self.load_reviews()
+            self.reviews_generation = generation
+        return generation
+
+    def reload(self):
+        """Swap in the current similarity database files, returning whether that succeeded.
+
+        If the new snapshot can't be opened, the error is logged and the old one is kept.
+
+        """
+        # the new snapshot is built before it replaces the old one, so in-flight requests aren't affected
+        try:
+            snapshot = Snapshot(self.beer_db_file_path, self.user_db_file_path)
+        except Exception:
+            print '[ERROR] Process %s failed to reload similarities; still serving version %s' % (os.getpid(), self.snapshot.version)
+            traceback.print_exc()
+            return False
+        self.snapshot = snapshot
+        self.num_reloads += 1
+        return True
+
+class RecommendationHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        routes = {
+            '/recommend': self.recommend,
+            '/predict': self.predict,
+            '/nearest': self.nearest,
+            '/complete': self.complete,
+            '/stats': self.stats,
+        }
+        if url.path not in routes:
+            self.send_json(404, {'error': 'Unknown endpoint: %s' % url.path})
+            return
+
+        self.server.num_requests += 1
+        # hold on to one snapshot for the whole request, in case of a reload
+        snapshot = self.server.snapshot
+        params = {key: values[0] for key, values in parse_qs(url.query).iteritems()}
+        try:
+            self.generation = self.server.sync_reviews()
+            result = routes[url.path](params, snapshot)
+        except RequestError as e:
+            self.send_json(e.code, {'error': str(e)})
+            return
+        except Exception as e:
+            self.log_error('Error handling %s: %r', self.path, e)
+            self.send_json(500, {'error': 'Internal error'})
+            return
+
+        result['version'] = snapshot.version
+        self.send_json(200, result)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path == '/reload':
+            # the parent process passes the signal on to every worker, this one included
+            os.kill(os.getppid(), signal.SIGHUP)
+            self.send_json(202, {'reloading': True})
+        elif url.path == '/invalidate':
+            params = parse_qs(url.query)
+            try:
+                beer_ids = [int(b) for b in params.get('beer', [])]
+            except ValueError:
+                self.send_json(400, {'error': 'Invalid beer: %s' % params['beer']})
+                return
+
+            # the other workers see the invalidations through the cache file
+            for username in params.get('user', []):
+                self.server.cache.invalidate_user(username)
+            for beer_id in beer_ids:
+                self.server.cache.invalidate_beer(beer_id)
+            self.server.sync_reviews()
+            self.send_json(200, {'users': params.get('user', []), 'beers': beer_ids})
+        else:
+            self.send_json(404, {'error': 'Unknown endpoint: %s' % url.path})
+
+    def recommend(self, params, snapshot):
+        username = self.get_username(params)
+        n = self.get_param(params, 'n', int, DEFAULT_NUM_RECOS)
+        aspect = self.get_aspect(params, 'overall')
+        k = self.get_param(params, 'k', int, DEFAULT_K)
+        reg = self.get_param(params, 'reg', float, DEFAULT_REG)
+
+        candidates = set()
+        def compute():
+            _, beer_ids = get_reco_candidates(username, aspect, self.server.df, snapshot.beer_db, n, k=k, reg=reg)
+            candidates.update(int(beer_id) for beer_id in beer_ids)
+            recos = rank_candidates(beer_ids, aspect, self.server.df, n)
+            return [{'beer_id': int(beer_id), 'average': float(avg)} for beer_id, avg in recos]
+
+        # the list depends on the user's ratings, and on the averages of all the candidates it was chosen from
+        recos = self.server.cache.get_or_compute(self.cache_key(snapshot, 'recommend', username, aspect, n, k, reg), compute,
+            users=[username], beers=lambda recos: candidates, generation=self.generation)
+
+        return {'user': username, 'aspect': aspect, 'recommendations': recos}
+
+    def predict(self, params, snapshot):
+        username = self.get_username(params)
+        beer_id = self.get_beer_id(params)
+        aspect = self.get_aspect(params, None)
+        k = self.get_param(params, 'k', int, DEFAULT_K)
+        reg = self.get_param(params, 'reg', float, DEFAULT_REG)
+
+        # the users and beers whose reviews the prediction draws on besides the user's and the beer's
+        neighbors = (set(), set())
+        def compute():
+            df = self.server.df
+            if aspect is None:
+                return float(predict_overall_rating(beer_id, username, snapshot.beer_db, snapshot.user_db, df, k=k, reg=reg, neighbors=neighbors))
+            else:
+                return float(predict_aspect_rating(beer_id, username, aspect, snapshot.beer_db, snapshot.user_db, df, k=k, reg=reg, neighbors=neighbors))
+
+        # the prediction's baseline includes the global average, which depends on every review
+        rating = self.server.cache.get_or_compute(self.cache_key(snapshot, 'predict', username, beer_id, aspect, k, reg), compute,
+            users=lambda rating: neighbors[0] | set([username]), beers=lambda rating: set(int(b) for b in neighbors[1]) | set([beer_id]),
+            all_reviews=True, generation=self.generation)
+
+        return {'user': username, 'beer_id': beer_id, 'aspect': aspect or 'overall', 'rating': rating}
+
+    def nearest(self, params, snapshot):
+        beer_id = self.get_beer_id(params)
+        aspect = self.get_aspect(params, 'overall')
+        k = self.get_param(params, 'k', int, DEFAULT_K)
+        reg = self.get_param(params, 'reg', float, DEFAULT_REG)
+
+        def compute():
+            nearest_beers = k_nearest(beer_id, self.server.unique_beer_ids, aspect, snapshot.beer_db, k=k, reg=reg)
+            return [{'beer_id': int(b), 'similarity': float(sim), 'support': int(support)} for b, sim, support in nearest_beers]
+
+        # similarities don't depend on reviews until the next snapshot, which has a new version
+        nearest_beers = self.server.cache.get_or_compute(self.cache_key(snapshot, 'nearest', beer_id, aspect, k, reg), compute,
+            generation=self.generation)
+
+        return {'beer_id': beer_id, 'aspect': aspect, 'nearest': nearest_beers}
+
+    def complete(self, params, snapshot):
+        if self.server.catalog is None:
+            raise RequestError(404, 'No beers were loaded')
+        try:
+            prefix = params.get('q', '').decode('utf_8')
+        except UnicodeDecodeError:
+            raise RequestError(400, 'Invalid q: not UTF-8')
+        n = self.get_param(params, 'n', int, DEFAULT_NUM_COMPLETIONS)
+        beers = self.server.catalog.complete(prefix, n)
+        return {'q': prefix, 'beers': [{'beer_id': int(beer_id), 'name': name} for name, beer_id in beers]}
+
+    def stats(self, params, snapshot):
+        return {
+            'pid': os.getpid(),
+            'uptime': time.time() - self.server.start_time,
+            'requests': self.server.num_requests,
+            'reloads': self.server.num_reloads,
+            'cache': self.server.cache.stats(),
+        }
+
+    def cache_key(self, snapshot, *args):
+        """Return the cache key of a result computed from the arguments, the snapshot, and the reviews."""
+        return args + (snapshot.version, self.server.reviews_version)
+
+    def get_param(self, params, name, convert, default):
+        if name not in params:
+            return default
+        try:
+            return convert(params[name])
+        except ValueError:
+            raise RequestError(400, 'Invalid %s: %s' % (name, params[name]))
+
+    def get_username(self, params):
+        if 'user' not in params:
+            raise RequestError(400, 'Missing parameter: user')
+        if params['user'] not in self.server.usernames:
+            raise RequestError(404, 'Unknown user: %s' % params['user'])
+        return params['user']
+
+    def get_beer_id(self, params):
+        if 'beer' not in params:
+            raise RequestError(400, 'Missing parameter: beer')
+        beer_id = self.get_param(params, 'beer', int, None)
+        if beer_id not in self.server.beer_ids:
+            raise RequestError(404, 'Unknown beer: %s' % beer_id)
+        return beer_id
+
+    def get_aspect(self, params, default):
+        aspect = params.get('aspect', default)
+        if aspect is not None and aspect not in ASPECTS:
+            raise RequestError(400, 'Unknown aspect: %s' % aspect)
+        return aspect
+
+    def send_json(self, code, result):
+        body = json.dumps(result)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_request(self, code='-', size='-'):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_request(self, code, size)
+
+def load_reviews(reviews_file_path):
+    """Load the reviews used by the recommender: those with a username and a text review."""
+    reviews_df = pd.read_csv(reviews_file_path)
+    reviews_df = reviews_df[pd.notnull(reviews_df['username'])]
+    reviews_df = reviews_df[pd.notnull(reviews_df['text'])]
+    return reviews_df
+
+def run_worker(server):
+    """Serve requests until told to stop; SIGHUP reloads the similarity databases."""
+    def handle_reload(signum, frame):
+        if server.reload():
+            print '[INFO] Worker %s reloaded similarities (version %s)' % (os.getpid(), server.snapshot.version)
+
+    def stop(signum, frame):
+        raise SystemExit
+
+    signal.signal(signal.SIGHUP, handle_reload)
+    # stop by unwinding, so that start_worker can flush the instrumentation
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    server.open_cache()
+    server.serve_forever()
+
+def start_worker(server):
+    """Fork a worker, returning its pid."""
+    pid = os.fork()
+    if pid == 0:
+        instrumentation.init_worker()
+        status = 1
+        try:
+            run_worker(server)
+        except SystemExit:
+            status = 0
+        except Exception:
+            traceback.print_exc()
+        finally:
+            # os._exit skips atexit, where the main process writes its summary
+            instrumentation.flush_worker()
+            os._exit(status)
+    return pid
+
+def run(server, num_workers):
+    """Fork the workers, pass reloads on to them, and replace any that die, until the service is stopped."""
+    # the start time of each worker, by pid
+    workers = {}
+    for _ in range(num_workers):
+        workers[start_worker(server)] = time.time()
+
+    def forward(signum, frame):
+        if signum == signal.SIGHUP:
+            # reload here too, so that replacement workers start with the current similarities
+            server.reload()
+        for pid in workers:
+            try:
+                os.kill(pid, signum)
+            except OSError as e:
+                # the worker has died, and will be replaced
+                if e.errno != errno.ESRCH:
+                    raise
+
+    def stop(signum, frame):
+        raise SystemExit
+
+    signal.signal(signal.SIGHUP, forward)
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        while True:
+            try:
+                pid, status = os.wait()
+            except OSError as e:
+                # a signal interrupted the wait
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if pid not in workers:
+                continue
+
+            print '[ERROR] Worker %s exited with status %s; starting a new one' % (pid, status)
+            if time.time() - workers.pop(pid) < RESPAWN_DELAY:
+                time.sleep(RESPAWN_DELAY)
+            workers[start_worker(server)] = time.time()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        forward(signal.SIGTERM, None)
+        for pid in workers:
+            try:
+                os.waitpid(pid, 0)
+            except OSError as e:
+                if e.errno != errno.ECHILD:
+                    raise
+        server.server_close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve recommendations over HTTP')
+    parser.add_argument('reviews', help='The reviews .csv file')
+    parser.add_argument('beer_db', help='The sqlite3 database file of beer similarities')
+    parser.add_argument('user_db', help='The sqlite3 database file of user similarities')
+    parser.add_argument('--beers', help='The beers .csv file, for autocompleting beer names')
+    parser.add_argument('--host', default='localhost', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Port to listen on')
+    parser.add_argument('-w', '--workers', type=int, default=cpu_count(), help='Number of worker processes')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CAPACITY, help='Number of results each worker caches in memory')
+    parser.add_argument('--cache-ttl', type=float, default=None, help='Seconds after which cached results expire')
+    parser.add_argument('--cache-file', default=None, help='sqlite3 file in which to keep the cache across restarts')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Log every request')
+    args = parser.parse_args()
+
+    print '[INFO] Loading reviews from %s' % args.reviews
+    cache_file_path = args.cache_file or join(tempfile.mkdtemp(), 'cache.db')
+    server = RecommendationServer((args.host, args.port), args.reviews, args.beer_db, args.user_db, cache_file_path,
+                                  cache_capacity=args.cache_size, cache_ttl=args.cache_ttl)
+
+    print '[INFO] Computing averages and aspect weights for %s reviews' % len(server.df)
+    precompute_averages(server.df)
+    precompute_aspect_weights(server.df)
+    server.verbose = args.verbose
+    if args.beers:
+        print '[INFO] Loading beers from %s' % args.beers
+        server.catalog = Catalog(pd.read_csv(args.beers))
+
+    print '[INFO] Serving on %s:%s with %s workers (similarity version %s)' % (args.host, args.port, args.workers, server.snapshot.version)
+    run(server, args.workers)
@@ -0,0 +1,312 @@
+"""
+# A cache of recommendation results.
+
+Predictions and recommendation lists are cached under keys that include
+every parameter they were computed with, including the version of the
+similarity snapshot, so results from old similarities are never served.
+Each result also records the users and beers whose reviews it depends on,
+and whether it depends on every review (e.g. through the global average);
+when reviews change, exactly the results that depend on them are dropped.
+
+Every invalidation starts a new generation of the cache. A result is put
+with the generation it was computed in, and is discarded if anything has
+been invalidated since, so a computation that overlaps an invalidation never
+writes back a stale result.
+
+The cache is a bounded LRU in memory, with an optional time-to-live. Given a
+path, it is also backed by a sqlite3 database, which keeps the cache warm
+across restarts and lets processes share results: each process checks the
+database's log of invalidations before every lookup, so a result invalidated
+by one process is never served by another.
+"""
+
+from collections import OrderedDict
+import json
+import sqlite3
+import threading
+import time
+
+from recommender import invalidate_averages
+
+DEFAULT_CAPACITY = 10000
+
+# the number of rows the database may hold per entry of in-memory capacity
+STORE_CAPACITY_FACTOR = 10
+
+# how many puts to the database between checks of its size
+PRUNE_INTERVAL = 1000
+
+USER = 'user'
+BEER = 'beer'
+# results that depend on every review have this kind of dependency, on ALL_REVIEWS
+ALL = 'all'
+ALL_REVIEWS = None
+
+class ResultCache(object):
+    """An LRU cache of results, keyed by tuples of JSON-serializable values.
+
+    Parameters
+    ----------
+    capacity : int
+        The maximum number of results kept in memory.
+    ttl : float
+        The number of seconds after which a result expires, or None to keep
+        results until they're evicted or invalidated.
+    path : string
+        The sqlite3 database file backing the cache, or None to keep the
+        cache in memory only.
+
+    """
+    def __init__(self, capacity=DEFAULT_CAPACITY, ttl=None, path=None):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.path = path
+
+        # cache statistics
+        self.hits = 0
+        self.misses = 0
+        self.store_hits = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+
+        self.lock = threading.RLock()
+        self.entries = OrderedDict()
+        # the keys of the cached results that depend on each user and beer, and on all reviews
+        self.dependents = {USER: {}, BEER: {}, ALL: {}}
+        # the sequence number of the latest invalidation applied, which is the cache's generation
+        self.last_invalidation = 0
+
+        self.connection = None
+        if path is not None:
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.execute("CREATE TABLE IF NOT EXISTS results (key text PRIMARY KEY, value text, expires real, created real)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS dependencies (key text, kind text, object_id text)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS dependencies_object ON dependencies (kind, object_id)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS dependencies_key ON dependencies (key)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS invalidations (seq integer PRIMARY KEY AUTOINCREMENT, kind text, object_id text)")
+            self.connection.commit()
+
+            # only invalidations made from now on matter; earlier ones have already been applied to the database
+            self.last_invalidation = self.connection.execute("SELECT COALESCE(MAX(seq), 0) FROM invalidations").fetchone()[0]
+            self.num_puts = 0
+
+    def get(self, key, default=None):
+        """Return the cached result for the key, or default if there isn't a live one."""
+        with self.lock:
+            self._sync()
+
+            entry = self.entries.pop(key, None)
+            if entry is not None and not self._expired(entry[1]):
+                self.entries[key] = entry
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                self._forget(key, entry)
+
+            entry = self._load(key)
+            if entry is not None:
+                self.hits += 1
+                self.store_hits += 1
+                self._cache(key, entry)
+                return entry[0]
+
+            self.misses += 1
+            return default
+
+    def generation(self):
+        """Return the cache's current generation, with which to put results computed from now on."""
+        with self.lock:
+            self._sync()
+            return self.last_invalidation
+
+    def put(self, key, value, users=(), beers=(), all_reviews=False, generation=None):
+        """Cache a result, recording the users and beers whose reviews it depends on, or that it depends on all of them.
+
+        If a generation is given, the result is discarded if anything has
+        been invalidated since that generation; return whether it was cached.
+
+        """
+        with self.lock:
+            if generation is not None:
+                if self.connection is not None:
+                    # hold the database's write lock from the check to the write, so that no invalidation can come between them
+                    self.connection.execute("BEGIN IMMEDIATE")
+                    latest = self.connection.execute("SELECT COALESCE(MAX(seq), 0) FROM invalidations").fetchone()[0]
+                else:
+                    latest = self.last_invalidation
+                if latest != generation:
+                    if self.connection is not None:
+                        self.connection.rollback()
+                    self.stale_puts += 1
+                    return False
+
+            now = time.time()
+            entry = (value, now + self.ttl if self.ttl is not None else None, set(users), set(beers), all_reviews)
+            self._cache(key, entry)
+
+            if self.connection is not None:
+                self._save(key, entry, now)
+            return True
+
+    def get_or_compute(self, key, compute, users=(), beers=(), all_reviews=False, generation=None):
+        """Return the cached result for the key, calling compute() and caching its result on a miss.
+
+        users and beers may be functions of the result, for results whose
+        dependencies aren't known until they've been computed. The result is
+        put with the given generation, which should be the one the data
+        passed to compute() is current with; by default, it's the generation
+        before compute() is called.
+
+        """
+        value = self.get(key)
+        if value is None:
+            if generation is None:
+                generation = self.generation()
+            value = compute()
+            self.put(key, value, users=users(value) if callable(users) else users, beers=beers(value) if callable(beers) else beers,
+                     all_reviews=all_reviews, generation=generation)
+        return value
+
+    def invalidate_user(self, username):
+        self._invalidate(USER, username)
+
+    def invalidate_beer(self, beer_id):
+        self._invalidate(BEER, beer_id)
+
+    def invalidate_reviews(self, reviews):
+        """Invalidate everything that depends on the users and beers of a DataFrame of new or changed reviews."""
+        for username in reviews['username'].unique():
+            self.invalidate_user(username)
+        for beer_id in reviews['beer_id'].unique():
+            self.invalidate_beer(beer_id)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.dependents = {USER: {}, BEER: {}, ALL: {}}
+            if self.connection is not None:
+                self.connection.execute("DELETE FROM results")
+                self.connection.execute("DELETE FROM dependencies")
+                self.connection.commit()
+
+    def stats(self):
+        """Return a dict of cache statistics."""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+            'store_hits': self.store_hits,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'stale_puts': self.stale_puts,
+            'cached': len(self.entries),
+        }
+
+    def _expired(self, expires):
+        return expires is not None and expires < time.time()
+
+    def _dependencies(self, entry):
+        """Yield the (kind, object_id) dependencies of an entry."""
+        for kind, object_ids in zip([USER, BEER], entry[2:4]):
+            for object_id in object_ids:
+                yield kind, object_id
+        if entry[4]:
+            yield ALL, ALL_REVIEWS
+
+    def _cache(self, key, entry):
+        """Put the entry at the most recently used end of the cache, evicting the least recently used."""
+        old_entry = self.entries.pop(key, None)
+        if old_entry is not None:
+            self._forget(key, old_entry)
+
+        self.entries[key] = entry
+        for kind, object_id in self._dependencies(entry):
+            self.dependents[kind].setdefault(object_id, set()).add(key)
+
+        while len(self.entries) > self.capacity:
+            old_key, old_entry = self.entries.popitem(last=False)
+            self._forget(old_key, old_entry)
+            self.evictions += 1
+
+    def _forget(self, key, entry):
+        """Remove a key that's no longer in memory from the dependency index."""
+        self.entries.pop(key, None)
+        for kind, object_id in self._dependencies(entry):
+            keys = self.dependents[kind].get(object_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.dependents[kind][object_id]
+
+    def _invalidate(self, kind, object_id, log=True):
+        with self.lock:
+            # any change to the reviews changes the results that depend on all of them
+            for key in self.dependents[kind].get(object_id, set()) | self.dependents[ALL].get(ALL_REVIEWS, set()):
+                self._forget(key, self.entries[key])
+                self.invalidations += 1
+
+            if kind == USER:
+                invalidate_averages(usernames=[object_id])
+            else:
+                invalidate_averages(beer_ids=[object_id])
+
+            if self.connection is None:
+                self.last_invalidation += 1
+            elif log:
+                # ids are stored as JSON so that beer IDs keep their type
+                object_id = json.dumps(object_id)
+                dependents = "SELECT key FROM dependencies WHERE (kind=? AND object_id=?) OR kind=?"
+                self.connection.execute("DELETE FROM results WHERE key IN (%s)" % dependents, (kind, object_id, ALL))
+                self.connection.execute("DELETE FROM dependencies WHERE key IN (%s)" % dependents, (kind, object_id, ALL))
+                cursor = self.connection.execute("INSERT INTO invalidations (kind, object_id) VALUES (?, ?)", (kind, object_id))
+                self.connection.commit()
+                # our own invalidation has been applied already
+                if cursor.lastrowid == self.last_invalidation + 1:
+                    self.last_invalidation = cursor.lastrowid
+
+    def _sync(self):
+        """Apply invalidations made by other processes sharing the database."""
+        if self.connection is None:
+            return
+
+        rows = self.connection.execute("SELECT seq, kind, object_id FROM invalidations WHERE seq > ? ORDER BY seq", (self.last_invalidation,)).fetchall()
+        for seq, kind, object_id in rows:
+            self._invalidate(kind, json.loads(object_id), log=False)
+            self.last_invalidation = seq
+
+    def _load(self, key):
+        if self.connection is None:
+            return None
+
+        row = self.connection.execute("SELECT value, expires FROM results WHERE key=?", (json.dumps(key),)).fetchone()
+        if row is None or self._expired(row[1]):
+            return None
+
+        dependencies = {USER: set(), BEER: set(), ALL: set()}
+        for kind, object_id in self.connection.execute("SELECT kind, object_id FROM dependencies WHERE key=?", (json.dumps(key),)):
+            dependencies[kind].add(json.loads(object_id))
+        return (json.loads(row[0]), row[1], dependencies[USER], dependencies[BEER], bool(dependencies[ALL]))
+
+    def _save(self, key, entry, now):
+        key = json.dumps(key)
+        self.connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", (key, json.dumps(entry[0]), entry[1], now))
+        self.connection.execute("DELETE FROM dependencies WHERE key=?", (key,))
+        self.connection.executemany("INSERT INTO dependencies VALUES (?, ?, ?)",
+            [(key, kind, json.dumps(object_id)) for kind, object_id in self._dependencies(entry)])
+        self.connection.commit()
+
+        self.num_puts += 1
+        if self.num_puts % PRUNE_INTERVAL == 0:
+            self._prune(now)
+
+    def _prune(self, now):
+        """Drop expired results from the database, and the oldest ones beyond its capacity."""
+        self.connection.execute("DELETE FROM results WHERE expires < ?", (now,))
+        self.connection.execute("DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY created DESC LIMIT -1 OFFSET ?)",
+            (self.capacity * STORE_CAPACITY_FACTOR,))
+        self.connection.execute("DELETE FROM dependencies WHERE key NOT IN (SELECT key FROM results)")
+        self.connection.execute("DELETE FROM invalidations WHERE seq <= (SELECT MAX(seq) FROM invalidations) - ?",
+            (self.capacity * STORE_CAPACITY_FACTOR,))
+        self.connection.commit()
@@ -5,13 +5,10 @@
 import argparse
 import re
 
-# from bs4 import BeautifulSoup
-from BeautifulSoup import BeautifulSoup
 import pandas as pd
-import requests
 
 from scraping_utils import BEER_URL_REGEX
-from scraping_utils import read_lines, log, process_urls
+from scraping_utils import read_lines, log, get_soup, process_urls
 
 BEER_STYLE_REGEX = re.compile(r'^/beer/style/\d+$')
 
@@ -49,7 +46,7 @@ def get_beer_info(beer_url, soup=None):
 
     # grab the main content div from the page
     if not soup:
-        soup = BeautifulSoup(requests.get(beer_url).text)
+        soup = get_soup(beer_url)
     content_div = soup.find('div', attrs={'id': 'baContent'})
 
     # get brewery and beer IDs from the URL
@@ -6,13 +6,10 @@ import argparse
 from datetime import datetime
 import re
 
-# from bs4 import BeautifulSoup
-from BeautifulSoup import BeautifulSoup
 import pandas as pd
-import requests
 
 from scraping_utils import BEER_URL_REGEX, BASE_URL
-from scraping_utils import read_lines, write_lines, log, print_progress_bar, get_next_link, process_urls
+from scraping_utils import read_lines, write_lines, log, print_progress_bar, get_soup, get_next_link, process_urls, instrumented
 
 from scrape_beer_data import BEER_CSV_FILE_NAME_TEMPLATE, get_beer_info
 
@@ -47,7 +44,7 @@ def get_brewery_listing_urls(url):
         A list of strings (URLs) pointing to brewery listing pages.
 
     """
-    soup = BeautifulSoup(requests.get(url).text)
+    soup = get_soup(url)
     table = soup.find('span', text='Categories').findNext('table')
     
     brewery_link = soup.find('a', text=BREWERY_LINK_REGEX)
@@ -79,7 +76,7 @@ def get_brewery_urls(listing_url):
         A list if strings (URLs) pointing to brewery pages.
 
     """
-    soup = BeautifulSoup(requests.get(listing_url).text)
+    soup = get_soup(listing_url)
 
     brewery_urls = [BASE_URL + a['href'] for a in soup('a', attrs={'href': re.compile('/profile/\d+')})]
 
@@ -104,7 +101,7 @@ def get_beer_urls(brewery_url):
         A list of strings (URLs) pointing to beer pages.
 
     """
-    soup = BeautifulSoup(requests.get(brewery_url).text)
+    soup = get_soup(brewery_url)
     beer_urls = [BASE_URL + a['href'] for a in soup('a', attrs={'href': re.compile('beer/profile/\d+/\d+$')})]
     return beer_urls
 
@@ -127,7 +124,7 @@ def get_reviews(beer_url):
     """
 
     # get data about the beer itself
-    soup = BeautifulSoup(requests.get(beer_url, params={'show_ratings': 'Y'}).text)
+    soup = get_soup(beer_url, params={'show_ratings': 'Y'})
     try:
         beer_df = get_beer_info(beer_url, soup)[0]
     except Exception as e:
@@ -148,7 +145,7 @@ def get_reviews(beer_url):
     next_url = beer_url
     while next_url:
         if not soup:
-            soup = BeautifulSoup(requests.get(next_url, params={'show_ratings': 'Y'}).text)
+            soup = get_soup(next_url, params={'show_ratings': 'Y'})
 
         brewery_id, beer_id = BEER_URL_REGEX.match(next_url).groups()
         id_dict = {'brewery_id': int(brewery_id), 'beer_id': int(beer_id)}
@@ -169,6 +166,7 @@ def get_reviews(beer_url):
 
     return [df, beer_df]
 
+@instrumented('scraper.extract_review_content')
 def extract_review_content(div):
     """Return a dictionary of review data from the given HTML div.
 
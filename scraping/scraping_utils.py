@@ -5,7 +5,18 @@
 import re
 import sys
 
+# from bs4 import BeautifulSoup
+from BeautifulSoup import BeautifulSoup
 import pandas as pd
+import requests
+
+# the instrumentation module is shared with the recommender, at the top of the repository; it's
+# importable when the scrapers are run from there (e.g. by benchmark.py), and otherwise nothing is timed
+try:
+    from instrumentation import instrumented
+except ImportError:
+    def instrumented(name):
+        return lambda func: func
 
 # One URL to rule them all, One URL to find them, One URL to bring them all and in the darkness bind them.
 # Ok, well, maybe not darkness, but you get the idea.
@@ -57,6 +68,20 @@ def print_progress_bar(x, y):
     sys.stdout.write(progress_bar_string.ljust(150) + '\r')
     sys.stdout.flush()
 
+@instrumented('scraper.fetch')
+def fetch(url, params=None):
+    """Return the text of the page at the given URL."""
+    return requests.get(url, params=params).text
+
+@instrumented('scraper.parse')
+def parse(html):
+    """Return the BeautifulSoup of the given HTML."""
+    return BeautifulSoup(html)
+
+def get_soup(url, params=None):
+    """Fetch and parse the page at the given URL."""
+    return parse(fetch(url, params=params))
+
 def get_next_link(soup, url):
     """Return a URL to the next page in the paginated series, or None if there's no such link."""
     next_links = [x.findParent('a') for x in soup('a', text=NEXT_TEXT_REGEX)]
@@ -0,0 +1,209 @@
+"""
+# Parallel sentence-aspect assignment (the assignment step of SentenceModel training).
+
+The model parameters live in shared memory that is allocated once, when the
+worker pool is created. Each iteration the parent copies the current theta/phi
+into that memory and only sends the workers the indices of the reviews to
+process, so nothing large is pickled per iteration.
+"""
+
+import heapq
+from multiprocessing import Pool, RawArray, cpu_count
+import time
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+import instrumentation
+
+# used to mark sentences that don't have an aspect assigned yet
+UNASSIGNED = -1
+
+# the number of batches handed to each worker process per iteration; more than one
+# so that a worker that finishes early can pick up another batch
+BATCHES_PER_PROCESS = 4
+
+# the state of a worker process, set once by _init_worker
+_WORKER = {}
+
+def _as_array(raw, shape):
+    """Return a numpy view of a shared RawArray; no data is copied."""
+    return np.ctypeslib.as_array(raw)[:int(np.prod(shape))].reshape(shape)
+
+def _init_worker(shared, shapes, num_extra_nodes):
+    """Pool initializer: wrap the shared buffers in numpy arrays once per process."""
+    instrumentation.init_worker()
+    _WORKER.clear()
+    for name, raw in shared.iteritems():
+        _WORKER[name] = _as_array(raw, shapes[name])
+    _WORKER['num_extra_nodes'] = num_extra_nodes
+
+def get_compatibilities(words, sentence_bounds, rating_indices, theta, phi):
+    """Return an (n_sentences, n_aspects) matrix of sentence-aspect compatibilities.
+
+    The compatibility of a sentence with aspect k is the sum over its words of
+    theta[k][w] + phi[k][r_k][w], where r_k is the review's rating for aspect k.
+
+    Parameters
+    ----------
+    words : int array
+        The word indices of all of the review's sentences, concatenated.
+    sentence_bounds : int array
+        Offsets into words; sentence j is words[bounds[j]:bounds[j + 1]].
+    rating_indices : int array
+        The index into RATINGS of the review's rating for each aspect.
+    theta : float array, shape (n_aspects, n_words)
+    phi : float array, shape (n_aspects, n_ratings, n_words)
+
+    """
+    num_aspects = theta.shape[0]
+    aspect_indices = np.arange(num_aspects)[:, np.newaxis]
+
+    weights = theta[:, words] + phi[aspect_indices, rating_indices[:, np.newaxis], words[np.newaxis, :]]
+
+    # sum the weights within each sentence; the cumulative sum handles sentences with no words
+    cumulative = np.zeros((num_aspects, len(words) + 1))
+    np.cumsum(weights, axis=1, out=cumulative[:, 1:])
+    return (cumulative[:, sentence_bounds[1:]] - cumulative[:, sentence_bounds[:-1]]).T
+
+def assign_aspects(compatibilities, num_extra_nodes):
+    """Return the index of the aspect assigned to each sentence of a review.
+
+    Each sentence gets its most compatible aspect, except that when the review
+    has at least as many sentences as there are aspects, each aspect is matched
+    to a distinct sentence by solving a rectangular linear assignment problem.
+    Sentences matched to one of the extra nodes keep their most compatible aspect.
+
+    """
+    num_sentences, num_aspects = compatibilities.shape
+    best_aspects = compatibilities.argmax(axis=1)
+
+    if num_sentences < num_aspects:
+        return best_aspects
+
+    # the extra columns cost the same as the sentence's best aspect
+    max_compatibilities = compatibilities[np.arange(num_sentences), best_aspects]
+    num_extra_columns = num_sentences + num_extra_nodes - num_aspects
+    cost = np.empty((num_sentences, num_aspects + num_extra_columns))
+    cost[:, :num_aspects] = -compatibilities
+    cost[:, num_aspects:] = -max_compatibilities[:, np.newaxis]
+
+    rows, cols = linear_sum_assignment(cost)
+    matched = cols < num_aspects
+    best_aspects[rows[matched]] = cols[matched]
+    return best_aspects
+
+def _assign_batch(review_positions):
+    """Compute new aspect assignments for a batch of reviews in a worker process."""
+    w = _WORKER
+    results = []
+    for p in review_positions:
+        first_sentence, last_sentence = w['review_offsets'][p], w['review_offsets'][p + 1]
+        bounds = w['sentence_offsets'][first_sentence:last_sentence + 1]
+        words = w['word_ids'][bounds[0]:bounds[-1]]
+
+        compatibilities = get_compatibilities(words, bounds - bounds[0], w['rating_indices'][p], w['theta'], w['phi'])
+        results.append((p, assign_aspects(compatibilities, w['num_extra_nodes'])))
+    return results
+
+def make_batches(sentence_counts, num_batches):
+    """Split review positions into batches with roughly equal numbers of sentences.
+
+    The assignment cost of a review grows with its number of sentences, so reviews
+    are dealt out largest first, each to the currently lightest batch.
+
+    """
+    heap = [(0, b) for b in range(min(num_batches, len(sentence_counts)))]
+    batches = [[] for _ in heap]
+    for p in sorted(range(len(sentence_counts)), key=lambda x: sentence_counts[x], reverse=True):
+        load, b = heapq.heappop(heap)
+        batches[b].append(p)
+        heapq.heappush(heap, (load + int(sentence_counts[p]), b))
+    return [batch for batch in batches if batch]
+
+class SentenceAssigner(object):
+    """Assigns aspects to the sentences of a corpus across a pool of processes.
+
+    The corpus is given as flat arrays: word_ids holds the word indices of every
+    sentence, sentence_offsets[j] is where sentence j starts in word_ids, and
+    review_offsets[p] is the index of review p's first sentence. Both offset
+    arrays have one extra trailing element marking the end.
+
+    """
+    def __init__(self, word_ids, sentence_offsets, review_offsets, rating_indices,
+                 num_aspects, num_ratings, num_words, num_extra_nodes=2, processes=None):
+        self.processes = processes or cpu_count()
+        self.num_extra_nodes = num_extra_nodes
+
+        num_reviews = len(review_offsets) - 1
+        self.review_offsets = np.asarray(review_offsets, dtype=np.int64)
+        self.assignments = np.empty(self.review_offsets[-1], dtype=np.int8)
+        self.assignments.fill(UNASSIGNED)
+
+        # statistics about the most recent iteration
+        self.num_changed = 0
+        self.last_time = 0.0
+
+        # allocate the shared buffers once; workers map them without copying
+        arrays = {
+            'word_ids': (np.asarray(word_ids), 'i'),
+            'sentence_offsets': (np.asarray(sentence_offsets), 'l'),
+            'review_offsets': (self.review_offsets, 'l'),
+            'rating_indices': (np.asarray(rating_indices).reshape(num_reviews, num_aspects), 'i'),
+            'theta': (np.zeros((num_aspects, num_words)), 'd'),
+            'phi': (np.zeros((num_aspects, num_ratings, num_words)), 'd'),
+        }
+        shared, self._shapes, self._views = {}, {}, {}
+        for name, (array, typecode) in arrays.iteritems():
+            raw = RawArray(typecode, max(array.size, 1))
+            view = _as_array(raw, array.shape)
+            view[...] = array
+            shared[name] = raw
+            self._shapes[name] = array.shape
+            self._views[name] = view
+
+        # the parent's views of the parameters; copy into them with set_parameters
+        self.theta = self._views['theta']
+        self.phi = self._views['phi']
+
+        sentence_counts = np.diff(self.review_offsets)
+        self.batches = make_batches(sentence_counts, self.processes * BATCHES_PER_PROCESS)
+
+        initargs = (shared, self._shapes, num_extra_nodes)
+        if self.processes > 1:
+            self.pool = Pool(self.processes, initializer=_init_worker, initargs=initargs)
+        else:
+            # no point in a pool of one; do the work in this process instead
+            self.pool = None
+            _init_worker(*initargs)
+
+    def set_parameters(self, theta, phi):
+        """Copy the current model parameters into shared memory."""
+        self.theta[...] = theta
+        self.phi[...] = phi
+
+    def update(self):
+        """Recompute all assignments, and return the number of sentences whose aspect changed."""
+        start = time.time()
+
+        if self.pool:
+            batch_results = self.pool.imap_unordered(_assign_batch, self.batches)
+        else:
+            batch_results = (_assign_batch(batch) for batch in self.batches)
+
+        num_changed = 0
+        for results in batch_results:
+            for p, aspects in results:
+                current = self.assignments[self.review_offsets[p]:self.review_offsets[p + 1]]
+                num_changed += np.count_nonzero(current != aspects)
+                current[:] = aspects
+
+        self.num_changed = num_changed
+        self.last_time = time.time() - start
+        return num_changed
+
+    def close(self):
+        if self.pool:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
@@ -0,0 +1,346 @@
+"""
+# The sentence aspect model used for textual analysis of reviews.
+"""
+
+import random
+import time
+
+import numpy as np
+
+from constants import ASPECTS, RATINGS
+from corpus import get_review_sentences
+from instrumentation import instrumented, timer
+from sentence_assignment import SentenceAssigner, UNASSIGNED
+
+class SentenceModel(object):
+    def __init__(self, df, corpus=None):
+        """Set up a model of the reviews in df.
+
+        If a Corpus containing the reviews is given, their sentences are read from
+        it instead of being tokenized again.
+
+        """
+        self.df = df
+        self.sentences = {}
+        self.words_set = set()
+        self.ratings = {}
+
+        # used for sentence aspect assignment
+        self.NUM_EXTRA_NODES = 2
+        
+        # some useful numbers
+        self.num_reviews = 0
+        self.num_rating_possibilites = len(ASPECTS) * len(RATINGS)
+        
+        # initialize sentences and words
+        for i, review in df.iterrows():
+            self.num_reviews += 1
+
+            if corpus is not None:
+                sentences = corpus.get_sentences(i)
+            else:
+                sentences = get_review_sentences(review['text'])
+
+            for words in sentences:
+                # add the sentence to the sentence dict
+                if i not in self.sentences:
+                    self.sentences[i] = []
+                self.sentences[i].append(['', words, None])
+                
+                # add the words to the global word set
+                self.words_set.update(words)
+
+            # record this review's ratings
+            self.ratings[i] = {}
+            for k in ASPECTS:
+                self.ratings[i][k] = review[k]
+
+        # a fixed ordering of the words, used to lay the parameters out as arrays
+        self.words = sorted(self.words_set)
+        
+        # initialize aspect weights
+        self.theta = {}
+        for aspect in ASPECTS:
+            self.theta[aspect] = {}
+            for w in self.words_set:
+                self.theta[aspect][w] = random.random() * 0.5
+        for aspect in ASPECTS:
+            self.theta[aspect][aspect] = 1.0
+        
+        # initialize sentiment weights
+        self.phi = {}
+        for aspect in ASPECTS:
+            self.phi[aspect] = {}
+            for r in RATINGS:
+                self.phi[aspect][r] = {}
+                for w in self.words_set:
+                   self.phi[aspect][r][w] = random.random() * 0.5
+        for aspect in ASPECTS:
+            self.phi[aspect][3.0][aspect] = 1
+        
+        # will be used later for gradient ascent; allocated with the parameter arrays
+        self.gradient_theta = None
+        self.gradient_phi = None
+
+        # the process pool used to update sentence assignments; created when training starts
+        self.processes = None
+        self._assigner = None
+
+    def __iter__(self):
+        """Allow for iteration through all sentences with one loop."""
+        for df_index, sentences in self.sentences.iteritems():
+            for sentence_num, sentence_data in enumerate(sentences):
+                yield (df_index, sentence_num, sentence_data[0], sentence_data[1], sentence_data[2])
+
+    def save_model(self, filename):
+        """Save the words and parameters as compact arrays in a .npz file."""
+        theta, phi = self.get_parameter_arrays()
+        np.savez(filename, words=np.array(self.words), theta=theta.astype(np.float32), phi=phi.astype(np.float32))
+
+    def load_model(self, filename):
+        data = np.load(filename)
+        self.set_parameter_arrays(list(data['words']), data['theta'], data['phi'])
+
+    def get_sentence_prob(self, i, j, aspect):
+        words = self.get_words(i, j)
+        
+        z = 0.0
+        this_aspect_sum = None
+        for k in ASPECTS:
+            weight_sum = 0.0
+            for w in words:
+                weight_sum += self.theta[k][w] + self.phi[k][self.ratings[i][k]][w]
+            
+            if k == aspect:
+                this_aspect_sum = weight_sum
+                
+            z += np.exp(weight_sum)
+                
+        return np.exp(this_aspect_sum) / z
+
+    def get_sentence_compatability(self, i, j, aspect, words=None):
+        if not words:
+            words = self.get_words(i, j)
+            
+        weight_sum = 0.0
+        for w in words:
+            weight_sum += self.theta[aspect][w] + self.phi[aspect][self.ratings[i][aspect]][w]
+        return weight_sum
+
+    def get_parameter_arrays(self):
+        """Return theta and phi as arrays indexed by [aspect][(rating,) word], in the order of self.words."""
+        theta = np.array([[self.theta[k][w] for w in self.words] for k in ASPECTS])
+        phi = np.array([[[self.phi[k][r][w] for w in self.words] for r in RATINGS] for k in ASPECTS])
+        return theta, phi
+
+    def set_parameter_arrays(self, words, theta, phi):
+        """Replace the words and parameters with those in the given arrays; the inverse of get_parameter_arrays."""
+        self.words = words
+        self.words_set = set(words)
+        self.theta = {}
+        self.phi = {}
+        for a, k in enumerate(ASPECTS):
+            self.theta[k] = dict(zip(words, theta[a].tolist()))
+            self.phi[k] = {}
+            for r_index, r in enumerate(RATINGS):
+                self.phi[k][r] = dict(zip(words, phi[a][r_index].tolist()))
+
+    def _init_assigner(self):
+        """Flatten the sentences into arrays and start the pool that will assign their aspects.
+
+        The parameter dicts are copied into the assigner's shared arrays once, here;
+        training updates those arrays in place, and copies them back into the dicts
+        when it finishes.
+
+        """
+        word_indices = {w: n for n, w in enumerate(self.words)}
+        rating_indices = {r: n for n, r in enumerate(RATINGS)}
+
+        self._review_keys = list(self.sentences.keys())
+
+        word_ids, sentence_offsets, review_offsets, review_ratings = [], [0], [0], []
+        for i in self._review_keys:
+            for _, words, _ in self.sentences[i]:
+                word_ids.extend(word_indices[w] for w in words)
+                sentence_offsets.append(len(word_ids))
+            review_offsets.append(len(sentence_offsets) - 1)
+            review_ratings.append([rating_indices[self.ratings[i][k]] for k in ASPECTS])
+
+        self._assigner = SentenceAssigner(word_ids, sentence_offsets, review_offsets, review_ratings,
+            len(ASPECTS), len(RATINGS), len(self.words), num_extra_nodes=self.NUM_EXTRA_NODES,
+            processes=self.processes)
+        self._assigner.set_parameters(*self.get_parameter_arrays())
+        self.gradient_theta = np.empty_like(self._assigner.theta)
+        self.gradient_phi = np.empty_like(self._assigner.phi)
+
+        # for every word of every sentence, the sentence it's in and the review's rating index for each aspect
+        sentence_lengths = np.diff(sentence_offsets)
+        sentence_reviews = np.repeat(np.arange(len(self._review_keys)), np.diff(review_offsets))
+        self._word_ids = np.asarray(word_ids, dtype=np.int64)
+        self._word_sentences = np.repeat(np.arange(len(sentence_lengths)), sentence_lengths)
+        review_ratings = np.asarray(review_ratings, dtype=np.int64).reshape(-1, len(ASPECTS))
+        self._word_ratings = review_ratings[sentence_reviews[self._word_sentences]].T
+
+    def _close_assigner(self):
+        if self._assigner:
+            self._assigner.close()
+            self._assigner = None
+
+    @instrumented('SentenceModel.update_assignments')
+    def _update_assignments(self):
+        """Reassign an aspect to every sentence, and return the number of sentences whose aspect changed.
+
+        The computation is "embarassingly parallel," so it's done across a pool of processes,
+        with the parameters in shared memory.
+
+        """
+        if not self._assigner:
+            self._init_assigner()
+
+        return self._assigner.update()
+
+    def _copy_assignments(self):
+        """Copy the assigner's aspect assignments, the working state during training, into the sentence dicts."""
+        assignments = self._assigner.assignments
+        position = 0
+        for i in self._review_keys:
+            for sentence_data in self.sentences[i]:
+                a = assignments[position]
+                sentence_data[2] = None if a == UNASSIGNED else ASPECTS[a]
+                position += 1
+    
+    def _get_compatibilities(self):
+        """Return an (n_sentences, n_aspects) array of every sentence's compatibility with every aspect."""
+        theta, phi = self._assigner.theta, self._assigner.phi
+        aspect_indices = np.arange(len(ASPECTS))[:, np.newaxis]
+        weights = theta[:, self._word_ids] + phi[aspect_indices, self._word_ratings, self._word_ids]
+
+        num_sentences = len(self._assigner.assignments)
+        return np.array([np.bincount(self._word_sentences, weights=weights[k], minlength=num_sentences)
+                         for k in range(len(ASPECTS))]).T
+
+    @instrumented('SentenceModel.compute_gradient')
+    def _compute_gradient(self):
+        theta, phi = self._assigner.theta, self._assigner.phi
+        np.multiply(theta, -1.0 * float(self.num_rating_possibilites), out=self.gradient_theta)
+        np.multiply(phi, -1.0 * float(self.num_rating_possibilites), out=self.gradient_phi)
+
+        assignments = self._assigner.assignments.astype(np.int64)
+        exp_scores = np.exp(self._get_compatibilities())
+        frac = exp_scores[np.arange(len(assignments)), assignments] / exp_scores.sum(axis=1)
+
+        # every word of a sentence with an aspect adds 1 - frac to that aspect's weights for the word
+        word_aspects = assignments[self._word_sentences]
+        assigned = np.flatnonzero(word_aspects != UNASSIGNED)
+        aspects = word_aspects[assigned]
+        words = self._word_ids[assigned]
+        ratings = self._word_ratings[aspects, assigned]
+        values = (1.0 - frac)[self._word_sentences[assigned]]
+
+        num_words = len(self.words)
+        self.gradient_theta += np.bincount(aspects * num_words + words, weights=values,
+                                           minlength=theta.size).reshape(theta.shape)
+        self.gradient_phi += np.bincount((aspects * len(RATINGS) + ratings) * num_words + words, weights=values,
+                                         minlength=phi.size).reshape(phi.shape)
+
+    @instrumented('SentenceModel.compute_log_likelihood')
+    def _compute_log_likelihood(self):
+        compatibilities = self._get_compatibilities()
+        assignments = self._assigner.assignments
+        assigned = np.flatnonzero(assignments != UNASSIGNED)
+
+        likelihood = compatibilities[assigned, assignments[assigned]].sum()
+        return likelihood - np.log(np.exp(compatibilities).sum(axis=1)).sum()
+    
+    @instrumented('SentenceModel.train')
+    def train(self, learning_rate=None, iterations=10, gradient_ascent_iterations=5, processes=None):
+        overall_start = time.time()
+
+        if not learning_rate:
+            learning_rate = float(self.num_rating_possibilites) * 0.01 / float(self.num_reviews)
+            print 'Defaulting to learning rate of %s' % learning_rate
+        
+        likelihood = 0.0
+        prev_likelihood = 0.0
+        
+        if processes:
+            self.processes = processes
+
+        try:
+            if not self._assigner:
+                self._init_assigner()
+            theta, phi = self._assigner.theta, self._assigner.phi
+
+            for iter_num in range(iterations):
+                main_iter_start = time.time()
+            
+                print 'Main iter %s' % iter_num
+                print '    Updating assignments...'
+                update_assignments_start = time.time()
+                num_changed = self._update_assignments()
+                print '        Time: %s s' % (time.time() - update_assignments_start)
+            
+                # if the model didn't change, no need to keep going
+                if (not num_changed):
+                    print '    Assignments did not change; breaking'
+                    break
+                else:
+                    print '    Assignments changed (%s sentences)' % num_changed
+            
+                likelihood = self._compute_log_likelihood()
+                if iter_num == 0:
+                    prev_likelihood = likelihood
+                print '    Starting likelihood: %s' % likelihood
+            
+                for g_iter_num in range(gradient_ascent_iterations):
+                    g_iter_start = time.time()
+                
+                    print '    Gradient ascent iter %s' % g_iter_num
+                    prev_likelihood = likelihood
+                    self._compute_gradient()
+                
+                    # do the actual gradient ascent
+                    with timer('SentenceModel.gradient_step'):
+                        theta += learning_rate * self.gradient_theta
+                        phi += learning_rate * self.gradient_phi
+                
+                    likelihood = self._compute_log_likelihood()
+                    print '        Likelihood: %s' % likelihood
+                
+                    # undo the last operation and break if likelihood didn't improve
+                    if not (likelihood > prev_likelihood):
+                        print '        Likelihood did not improve; undoing and breaking'
+                        theta -= learning_rate * self.gradient_theta
+                        phi -= learning_rate * self.gradient_phi
+                        likelihood = prev_likelihood
+                        break
+                
+                    print '        Time: %s s' % (time.time() - g_iter_start)
+            
+                # move each word's mean phi over ratings into theta
+                with timer('SentenceModel.normalize'):
+                    pi = phi.mean(axis=1)
+                    phi -= pi[:, np.newaxis, :]
+                    theta += pi
+            
+                prev_likelihood = likelihood
+            
+                print '    Likelihood: %s' % likelihood
+                print '    Time: %s s' % (time.time() - main_iter_start)
+        finally:
+            # copy the trained parameters and assignments back into the dicts, and shut down the assignment worker pool
+            if self._assigner:
+                self.set_parameter_arrays(self.words, self._assigner.theta, self._assigner.phi)
+                self._copy_assignments()
+            self._close_assigner()
+
+        print 'Total time: %s s' % (time.time() - overall_start)
+    
+    def get_aspect(self, i, j):
+        return self.sentences[i][j][2]
+    
+    def set_aspect(self, i, j, aspect):
+        self.sentences[i][j][2] = aspect
+        
+    def get_words(self, i, j):
+        return self.sentences[i][j][1]
@@ -1,35 +1,225 @@
-import urllib, urllib2
-import json
+"""
+# Offline sentiment scoring of review sentences.
+
+Sentiment comes from a linear model over words, trained on our own rated
+reviews: each word's weight is how much it moves a review's overall rating
+away from the average, fit by regularized least squares. A sentence's score
+is the sum of its words' weights, i.e. a rating offset in stars.
+"""
+
+import argparse
+from collections import OrderedDict
+from multiprocessing import Pool, cpu_count
+from os.path import dirname, exists, join
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from scipy.sparse.linalg import lsqr
+
+from constants import WORD_SPLIT_REGEX
+
+# sentences scoring within this many stars of the average are neutral
+NEUTRAL_THRESHOLD = 0.25
+
+# how far past the neutral threshold, in stars, a score must be for confidence to reach ~88%
+CONFIDENCE_SCALE = 1.0
+
+# confidences above this scale to the extremes of the 1-5 scale; see scale_sentiment
+STRONG_CONFIDENCE = 60
+
+# words seen in fewer reviews than this don't get a weight
+MIN_WORD_COUNT = 5
+
+DEFAULT_REG = 10.0
+DEFAULT_CACHE_SIZE = 10000
+
+# where get_sentiment looks for a model if none has been set
+DEFAULT_MODEL_FILE = join(dirname(__file__), 'sentiment_model.npz')
+
+# the number of sentences scored by a worker at a time in process pool mode
+CHUNK_SIZE = 10000
+
+def get_words(text):
+	"""Return the set of lowercased words in the text.
+
+	Unlike the aspect model, common words aren't excluded; words like
+	'not' and 'good' carry a lot of sentiment.
+
+	"""
+	return set([w.lower() for w in WORD_SPLIT_REGEX.findall(text)])
+
+class NoModelError(Exception):
+	pass
+
+class SentimentModel(object):
+	def __init__(self, vocabulary, weights, average):
+		self.vocabulary = vocabulary
+		self.weights = np.asarray(weights, dtype=float)
+		self.average = average
+		self.word_lookup = {w: n for n, w in enumerate(vocabulary)}
+
+	@classmethod
+	def train(cls, texts, ratings, reg=DEFAULT_REG, min_word_count=MIN_WORD_COUNT):
+		"""Fit word weights to the given review texts and their overall ratings."""
+		ratings = np.asarray(ratings, dtype=float)
+		average = ratings.mean()
+
+		word_sets = [get_words(t) for t in texts]
+
+		counts = {}
+		for words in word_sets:
+			for w in words:
+				counts[w] = counts.get(w, 0) + 1
+		vocabulary = sorted(w for w, c in counts.iteritems() if c >= min_word_count)
+
+		model = cls(vocabulary, np.zeros(len(vocabulary)), average)
+		X = model._get_matrix(word_sets)
+		model.weights = lsqr(X, ratings - average, damp=np.sqrt(reg))[0]
+		return model
+
+	def _get_matrix(self, word_sets):
+		"""Return a sparse (n_texts, n_words) indicator matrix of the known words in each set."""
+		rows, cols = [], []
+		lookup = self.word_lookup
+		for i, words in enumerate(word_sets):
+			for w in words:
+				n = lookup.get(w)
+				if n is not None:
+					rows.append(i)
+					cols.append(n)
+		return csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(word_sets), len(self.vocabulary)))
+
+	def score(self, sentences):
+		"""Return an array of sentence scores: the predicted offset from the average rating, in stars."""
+		return self._get_matrix([get_words(s) for s in sentences]).dot(self.weights)
+
+	def save(self, filename):
+		np.savez(filename, vocabulary=np.array(self.vocabulary), weights=self.weights, average=self.average)
+
+	@classmethod
+	def load(cls, filename):
+		data = np.load(filename)
+		return cls(list(data['vocabulary']), data['weights'], float(data['average']))
+
+def score_to_sentiment(score):
+	"""Convert a sentence score to a (sentiment, confidence) pair, confidence being a percentage.
+
+	Positive and negative confidence grows from 50% at the neutral threshold
+	towards 100% the further past it the score is.
+
+	"""
+	magnitude = abs(score)
+	if magnitude < NEUTRAL_THRESHOLD:
+		return 'Neutral', 50.0 + 50.0 * (1.0 - magnitude / NEUTRAL_THRESHOLD)
+
+	confidence = 50.0 + 50.0 * np.tanh((magnitude - NEUTRAL_THRESHOLD) / CONFIDENCE_SCALE)
+	if score > 0:
+		return 'Positive', confidence
+	else:
+		return 'Negative', confidence
+
+"""
+# The module-level interface: a default model plus a bounded cache of scored sentences.
+"""
+
+_MODEL = None
+_CACHE = OrderedDict()
+_CACHE_SIZE = DEFAULT_CACHE_SIZE
+
+def set_model(model, cache_size=DEFAULT_CACHE_SIZE):
+	"""Set the model used by get_sentiment and get_sentiment_batch, and clear the cache."""
+	global _MODEL, _CACHE_SIZE
+	_MODEL = model
+	_CACHE_SIZE = cache_size
+	_CACHE.clear()
+
+def _cache_put(sentence, result):
+	_CACHE[sentence] = result
+	while len(_CACHE) > _CACHE_SIZE:
+		_CACHE.popitem(last=False)
+
+def _init_worker(model):
+	set_model(model, cache_size=0)
+
+def _score_chunk(sentences):
+	return _MODEL.score(sentences)
 
 def get_sentiment(sentence):
-	url ='http://sentiment.vivekn.com/api/text/'
-	values = {'txt' : sentence}
+	return get_sentiment_batch([sentence])[0]
+
+def get_sentiment_batch(sentences, processes=1):
+	"""Return a list of (sentiment, confidence) pairs, one per sentence.
 
-	data = urllib.urlencode(values)
-	req = urllib2.Request(url, data)
-	response = urllib2.urlopen(req)
+	Sentences that have been scored recently come from the cache; the rest
+	are scored together with one sparse matrix product. With processes > 1,
+	the uncached sentences are split into chunks and scored across a pool of
+	processes (all cores if None), which is worthwhile for full-corpus runs.
 
-	# print response.geturl()
-	# print response.info()
-	sentiment_response = response.read()
-	# print sentiment
+	"""
+	if _MODEL is None:
+		if not exists(DEFAULT_MODEL_FILE):
+			raise NoModelError('No sentiment model; train one with this script or pass one to set_model first')
+		set_model(SentimentModel.load(DEFAULT_MODEL_FILE), cache_size=_CACHE_SIZE)
+	if processes is None:
+		processes = cpu_count()
 
-	json_sent = json.loads(sentiment_response)
-	confidence = json_sent['result']['confidence']
-	sentiment = json_sent['result']['sentiment']
+	results = [None] * len(sentences)
+	to_score = OrderedDict()
+	for i, s in enumerate(sentences):
+		if s in _CACHE:
+			# move the sentence to the most recently used end of the cache
+			results[i] = _CACHE.pop(s)
+			_CACHE[s] = results[i]
+		else:
+			to_score.setdefault(s, []).append(i)
+
+	unique = to_score.keys()
+	if processes > 1 and len(unique) > CHUNK_SIZE:
+		chunks = [unique[start:start + CHUNK_SIZE] for start in range(0, len(unique), CHUNK_SIZE)]
+		pool = Pool(processes, initializer=_init_worker, initargs=(_MODEL,))
+		try:
+			scores = np.concatenate(pool.map(_score_chunk, chunks))
+		finally:
+			pool.close()
+			pool.join()
+	else:
+		scores = _MODEL.score(unique)
 
-	return sentiment, confidence
+	for s, score in zip(unique, scores):
+		result = score_to_sentiment(score)
+		for i in to_score[s]:
+			results[i] = result
+		_cache_put(s, result)
+
+	return results
 
 def scale_sentiment(sentiment, confidence):
 	if sentiment == 'Neutral':
 		return 3
-	else if sentiment == 'Positive':
-		if confidence > 60:
+	elif sentiment == 'Positive':
+		if confidence > STRONG_CONFIDENCE:
 			return 5
 		else:
 			return 4
 	else:
-		if confidence > 60:
+		if confidence > STRONG_CONFIDENCE:
 			return 1
 		else:
 			return 2
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Train a sentiment model on rated reviews')
+	parser.add_argument('reviews', help='The reviews .csv file')
+	parser.add_argument('dest', nargs='?', default=DEFAULT_MODEL_FILE, help='The file to which to write the model (.npz)')
+	parser.add_argument('-r', '--reg', type=float, default=DEFAULT_REG, help='Regularization strength')
+	args = parser.parse_args()
+
+	reviews_df = pd.read_csv(args.reviews)
+	reviews_df = reviews_df[pd.notnull(reviews_df['text']) & pd.notnull(reviews_df['overall'])]
+
+	print '[INFO] Training on %s reviews' % len(reviews_df)
+	model = SentimentModel.train(reviews_df['text'], reviews_df['overall'], reg=args.reg)
+
+	print '[INFO] Writing %s word weights to %s' % (len(model.vocabulary), args.dest)
+	model.save(args.dest)
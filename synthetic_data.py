@@ -0,0 +1,176 @@
+"""
+# Synthetic review data.
+
+Generates users, beers, and reviews in the same schema as the scraped reviews
+and beers .csv files, at any scale, so that the recommender can be run and
+benchmarked without the full scrape. Reviews per user follow a power law,
+like the real data: most users write a handful of reviews and a few write
+thousands. Ratings are a beer quality plus a user bias plus noise, rounded to
+quarter stars, and review text is drawn from a Zipf distribution over a
+vocabulary of beer words and filler words.
+"""
+
+import argparse
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from constants import ASPECTS_MINUS_OVERALL
+
+DEFAULT_NUM_USERS = 1000
+DEFAULT_NUM_BEERS = 500
+DEFAULT_NUM_BREWERIES = 50
+
+# the exponent of the power law of reviews per user; the real data's is roughly 2
+DEFAULT_EXPONENT = 2.0
+
+# the fraction of beers that are aliases for other beers, as on BeerAdvocate
+ALIAS_FRACTION = 0.02
+
+BEER_WORDS = [
+    'hoppy', 'malty', 'golden', 'amber', 'hazy', 'clear', 'bitter', 'sweet', 'sour', 'crisp', 'thin', 'thick',
+    'creamy', 'aroma', 'nose', 'citrus', 'pine', 'caramel', 'toffee', 'chocolate', 'coffee', 'roasted', 'fruity',
+    'banana', 'clove', 'head', 'lacing', 'carbonation', 'mouthfeel', 'body', 'finish', 'smooth', 'harsh', 'dry',
+    'watery', 'boozy', 'balanced', 'drinkable', 'nice', 'great', 'good', 'bad', 'decent', 'excellent', 'poured',
+    'glass', 'bottle', 'tap', 'pint', 'taste', 'smell', 'look', 'feel', 'overall', 'color', 'foam', 'light', 'dark',
+]
+NUM_FILLER_WORDS = 2000
+SERVING_TYPES = ['bottle', 'can', 'on-tap', 'cask', 'growler']
+STYLES = ['American IPA', 'American Pale Ale (APA)', 'Russian Imperial Stout', 'Hefeweizen', 'Belgian Strong Dark Ale',
+          'American Porter', 'Saison / Farmhouse Ale', 'American Adjunct Lager', 'Witbier', 'English Bitter']
+
+def get_vocabulary(rng):
+    """Return the beer words followed by random filler words, most common first."""
+    letters = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+    filler = set()
+    while len(filler) < NUM_FILLER_WORDS:
+        filler.add(''.join(rng.choice(letters, rng.randint(3, 10))))
+    return BEER_WORDS + sorted(filler)
+
+def get_text(rng, vocabulary, word_probs):
+    sentences = []
+    for _ in range(rng.randint(3, 12)):
+        words = vocabulary[rng.choice(len(vocabulary), rng.randint(4, 16), p=word_probs)]
+        sentences.append(' '.join(words).capitalize() + '.')
+    return ' '.join(sentences) + '\n\nServing type: ' + SERVING_TYPES[rng.randint(len(SERVING_TYPES))]
+
+def round_rating(rating):
+    return np.clip(np.round(rating * 4) / 4, 1.0, 5.0)
+
+def make_beers(num_beers=DEFAULT_NUM_BEERS, num_breweries=DEFAULT_NUM_BREWERIES, seed=0):
+    """Return a DataFrame of beers in the schema of the scraped beers .csv file."""
+    rng = np.random.RandomState(seed)
+    beer_ids = np.arange(1, num_beers + 1)
+    brewery_ids = rng.randint(1, num_breweries + 1, num_beers)
+
+    df = pd.DataFrame({
+        'beer_id': beer_ids,
+        'brewery_id': brewery_ids,
+        'beer_name': ['Beer %s' % b for b in beer_ids],
+        'brewery_name': ['Brewery %s' % b for b in brewery_ids],
+        'style': [STYLES[i] for i in rng.randint(len(STYLES), size=num_beers)],
+        'abv': np.round(rng.uniform(3.0, 12.0, num_beers), 1),
+        'ba_score': None,
+        'bros_score': None,
+        'num_ratings': 0,
+        'num_reviews': 0,
+        'r_avg': None,
+        'p_dev': None,
+        'alias_id': None,
+        'alias_name': '',
+    })
+
+    # aliases point at another beer from the same brewery, and have no ratings of their own
+    for i in rng.choice(num_beers, int(num_beers * ALIAS_FRACTION), replace=False):
+        same_brewery = np.flatnonzero((brewery_ids == brewery_ids[i]) & (beer_ids != beer_ids[i]))
+        if len(same_brewery):
+            target = same_brewery[rng.randint(len(same_brewery))]
+            df.loc[i, 'alias_id'] = beer_ids[target]
+            df.loc[i, 'alias_name'] = df.loc[target, 'beer_name']
+
+    return df
+
+def make_reviews(beers_df, num_users=DEFAULT_NUM_USERS, exponent=DEFAULT_EXPONENT, seed=0):
+    """Return a DataFrame of reviews of the given beers in the schema of the scraped reviews .csv file."""
+    rng = np.random.RandomState(seed)
+    vocabulary = np.array(get_vocabulary(rng))
+    word_probs = 1.0 / np.arange(1, len(vocabulary) + 1)
+    word_probs /= word_probs.sum()
+
+    beers_df = beers_df[pd.isnull(beers_df['alias_id'])]
+    beer_ids = beers_df['beer_id'].values
+    brewery_ids = dict(zip(beers_df['beer_id'], beers_df['brewery_id']))
+
+    # popular beers get more reviews, and are better
+    beer_popularity = 1.0 / np.arange(1, len(beer_ids) + 1) ** 0.8
+    beer_popularity /= beer_popularity.sum()
+    beer_quality = dict(zip(beer_ids, 3.2 + 0.8 * beer_popularity / beer_popularity.max() + rng.normal(0, 0.4, len(beer_ids))))
+
+    # the number of reviews per user follows a power law, capped at the number of beers
+    reviews_per_user = np.minimum(rng.zipf(exponent, num_users), len(beer_ids))
+
+    start = datetime(2002, 1, 1)
+    rows = []
+    for u, n in enumerate(reviews_per_user):
+        username = 'user%s' % u
+        user_bias = rng.normal(0, 0.3)
+        aspect_biases = rng.normal(0, 0.2, len(ASPECTS_MINUS_OVERALL))
+        for beer_id in rng.choice(beer_ids, n, replace=False, p=beer_popularity):
+            aspect_ratings = round_rating(beer_quality[beer_id] + user_bias + aspect_biases + rng.normal(0, 0.4, len(aspect_biases)))
+            overall = round_rating(aspect_ratings.mean() + rng.normal(0, 0.2))
+            ratings = dict(zip(ASPECTS_MINUS_OVERALL, aspect_ratings))
+            ratings['overall'] = overall
+            rating = round(0.06 * ratings['look'] + 0.24 * ratings['smell'] + 0.4 * ratings['taste']
+                           + 0.1 * ratings['feel'] + 0.2 * ratings['overall'], 2)
+
+            row = {
+                'username': username,
+                'beer_id': beer_id,
+                'brewery_id': brewery_ids[beer_id],
+                'rating': rating,
+                'rDev': 0.0,
+                'user_location': None,
+                'serving_type': SERVING_TYPES[rng.randint(len(SERVING_TYPES))],
+                'text': get_text(rng, vocabulary, word_probs),
+                'timestamp': start + timedelta(seconds=int(rng.randint(0, 12 * 365 * 24 * 3600))),
+            }
+            row.update(ratings)
+            rows.append(row)
+
+    df = pd.DataFrame(rows)
+    beer_means = df.groupby('beer_id')['rating'].transform('mean')
+    df['rDev'] = np.round(100.0 * (df['rating'] - beer_means) / beer_means, 1)
+    return df
+
+def review_to_html(review):
+    """Return the HTML of a review's div on a BeerAdvocate beer page, as parsed by scraping/scrape_reviews.py."""
+    subratings = ' | '.join('%s: %s' % (aspect, '%g' % review[aspect]) for aspect in ASPECTS_MINUS_OVERALL)
+    lines = [
+        '<div id="rating_fullview_content_2"><h6><a href="/community/members/%s.html">%s</a></h6>' % (review['username'], review['username']),
+        'Anytown, USA',
+        '',
+        '<span class="BAscore_norm">%.2f</span>/5&nbsp;&nbsp;rDev %+.1f%%' % (review['rating'], review['rDev']),
+        '%s |  overall: %s' % (subratings, '%g' % review['overall']),
+        '',
+    ]
+    lines += review['text'].split('\n')
+    lines += ['', review['timestamp'].strftime('%m-%d-%Y %H:%M:%S') + '</div>']
+    return '<br />'.join(lines)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic reviews and beers')
+    parser.add_argument('reviews', help='The .csv file to which to write the reviews')
+    parser.add_argument('beers', help='The .csv file to which to write the beers')
+    parser.add_argument('-u', '--users', type=int, default=DEFAULT_NUM_USERS, help='Number of users')
+    parser.add_argument('-b', '--beers', type=int, default=DEFAULT_NUM_BEERS, dest='num_beers', help='Number of beers')
+    parser.add_argument('-e', '--exponent', type=float, default=DEFAULT_EXPONENT, help='Power law exponent of reviews per user')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+
+    beers_df = make_beers(args.num_beers, seed=args.seed)
+    reviews_df = make_reviews(beers_df, num_users=args.users, exponent=args.exponent, seed=args.seed)
+
+    print '[INFO] Writing %s reviews by %s users of %s beers' % (len(reviews_df), args.users, args.num_beers)
+    reviews_df.to_csv(args.reviews, index=False, encoding='utf-8')
+    beers_df.to_csv(args.beers, index=False, encoding='utf-8')
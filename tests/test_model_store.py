@@ -0,0 +1,98 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from corpus import build_corpus
+from model_store import ModelStore, WORDS_FILE_NAME, PARAMS_FILE_NAME
+from synthetic_data import make_beers, make_reviews
+
+class ModelStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        # training prints its progress
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+        reviews_df = make_reviews(make_beers(20, num_breweries=5), num_users=30, exponent=1.8, seed=1)
+        self.username = reviews_df.groupby('username').size().idxmax()
+
+        # hold back some of the user's reviews, to be added later
+        new_index = reviews_df[reviews_df['username'] == self.username].index[-3:]
+        self.all_df = reviews_df
+        self.df = reviews_df.drop(new_index)
+        self.corpus = build_corpus(self.df, processes=1)
+
+    def tearDown(self):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+        shutil.rmtree(self.path)
+
+    def open_store(self, corpus=None):
+        return ModelStore(self.path, self.df, corpus or self.corpus, train_kwargs={'iterations': 2})
+
+    def test_retrains_after_new_reviews(self):
+        store = self.open_store()
+        model = store.get(self.username)
+        self.assertEqual(model.num_reviews, len(self.df[self.df['username'] == self.username]))
+
+        # the new reviews' text isn't in the corpus; the store adds it
+        store.update_reviews(self.all_df)
+        store.queue.join()
+
+        model = store.get(self.username)
+        self.assertEqual(model.num_reviews, len(self.all_df[self.all_df['username'] == self.username]))
+        self.assertEqual(store.stats()['trained'], 2)
+        self.assertEqual(store.stats()['pending'], 0)
+
+        # the model is saved with the extended vocabulary, which keeps the old word ids
+        store = ModelStore(self.path, self.all_df, store.corpus)
+        self.assertEqual(store.get(self.username).num_reviews, model.num_reviews)
+        self.assertEqual(store.stats()['trained'], 0)
+
+    def test_retrain_failure_keeps_worker_alive(self):
+        store = self.open_store()
+        store.get(self.username)
+
+        train = store._train
+        def fail(*args):
+            raise ValueError('training failed')
+        store._train = fail
+        store.update_reviews(self.all_df)
+        store.queue.join()
+        self.assertTrue(store.thread.is_alive())
+        self.assertEqual(store.stats()['pending'], 0)
+
+        store._train = train
+        store.update_reviews(self.all_df)
+        store.queue.join()
+        self.assertEqual(store.get(self.username).num_reviews, len(self.all_df[self.all_df['username'] == self.username]))
+
+    def test_other_vocabulary_is_retrained(self):
+        self.open_store().get(self.username)
+
+        # tokenizing the reviews in another order gives the words other ids
+        corpus = build_corpus(self.df.iloc[::-1], processes=1)
+        self.assertNotEqual(corpus.get_fingerprint(), self.corpus.get_fingerprint())
+        store = self.open_store(corpus)
+        store.get(self.username)
+        self.assertEqual(store.stats()['trained'], 1)
+
+    def test_unindexed_data_is_truncated(self):
+        self.open_store().get(self.username)
+        sizes = [os.path.getsize(os.path.join(self.path, file_name)) for file_name in [WORDS_FILE_NAME, PARAMS_FILE_NAME]]
+
+        # as if a save had died between writing its data and committing its row
+        for file_name in [WORDS_FILE_NAME, PARAMS_FILE_NAME]:
+            with open(os.path.join(self.path, file_name), 'ab') as f:
+                f.write('\0' * 12)
+
+        store = self.open_store()
+        self.assertEqual([os.path.getsize(os.path.join(self.path, file_name)) for file_name in [WORDS_FILE_NAME, PARAMS_FILE_NAME]], sizes)
+        self.assertEqual(store.stats()['trained'], 0)
+        store.get(self.username)
+        self.assertEqual(store.stats()['trained'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from result_cache import ResultCache
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def cache_pairs(self):
+        """Yield pairs of caches seen by two processes: one in memory, shared by both, and two sharing a database."""
+        memory_cache = ResultCache()
+        yield memory_cache, memory_cache
+        yield self.open_shared_caches()
+
+    def open_shared_caches(self):
+        file_name = os.path.join(self.path, 'cache.db')
+        return ResultCache(path=file_name), ResultCache(path=file_name)
+
+    def test_discards_results_computed_before_an_invalidation(self):
+        for cache, other_cache in self.cache_pairs():
+            generation = cache.generation()
+            # the result is being computed when another of the user's reviews comes in
+            other_cache.invalidate_user('alice')
+            self.assertFalse(cache.put('key', 1.0, users=['alice'], generation=generation))
+            self.assertIsNone(cache.get('key'))
+            self.assertIsNone(other_cache.get('key'))
+
+            self.assertTrue(cache.put('key', 2.0, users=['alice'], generation=cache.generation()))
+            self.assertEqual(other_cache.get('key'), 2.0)
+
+    def test_get_or_compute_stamps_the_generation_before_computing(self):
+        cache, other_cache = self.open_shared_caches()
+        def compute():
+            other_cache.invalidate_beer(7)
+            return 3.0
+        self.assertEqual(cache.get_or_compute('key', compute, beers=[7]), 3.0)
+        self.assertIsNone(other_cache.get('key'))
+        self.assertEqual(cache.stats()['stale_puts'], 1)
+
+    def test_results_depending_on_all_reviews(self):
+        for cache, other_cache in self.cache_pairs():
+            cache.put('global', 1.0, all_reviews=True)
+            cache.put('user', 2.0, users=['alice'])
+            other_cache.invalidate_beer(7)
+            self.assertIsNone(cache.get('global'))
+            self.assertIsNone(other_cache.get('global'))
+            self.assertEqual(other_cache.get('user'), 2.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+
+import sentiment
+from sentiment import SentimentModel, NoModelError, NEUTRAL_THRESHOLD, get_sentiment_batch, scale_sentiment, score_to_sentiment, set_model
+
+class ScaleSentimentTest(unittest.TestCase):
+	def test_every_rating_is_reachable(self):
+		scores = [-3.0, -NEUTRAL_THRESHOLD - 0.05, 0.0, NEUTRAL_THRESHOLD + 0.05, 3.0]
+		self.assertEqual([scale_sentiment(*score_to_sentiment(s)) for s in scores], [1, 2, 3, 4, 5])
+
+	def test_confidence_is_continuous_at_the_threshold(self):
+		_, confidence = score_to_sentiment(NEUTRAL_THRESHOLD)
+		self.assertAlmostEqual(confidence, 50.0)
+
+	def test_model_scores_reach_every_rating(self):
+		words = ['awful', 'meh', 'fine', 'nice', 'superb']
+		model = SentimentModel(words, [-2.0, -0.35, 0.0, 0.35, 2.0], 3.5)
+		set_model(model)
+		try:
+			results = get_sentiment_batch(['This is %s.' % w for w in words])
+		finally:
+			set_model(None)
+		self.assertEqual([scale_sentiment(*r) for r in results], [1, 2, 3, 4, 5])
+
+class NoModelTest(unittest.TestCase):
+	def test_missing_model_raises(self):
+		default_model_file = sentiment.DEFAULT_MODEL_FILE
+		sentiment.DEFAULT_MODEL_FILE = '/nonexistent/sentiment_model.npz'
+		set_model(None)
+		try:
+			self.assertRaises(NoModelError, get_sentiment_batch, ['Good beer.'])
+		finally:
+			sentiment.DEFAULT_MODEL_FILE = default_model_file
+
+if __name__ == '__main__':
+	unittest.main()
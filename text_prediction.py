@@ -0,0 +1,119 @@
+"""
+# Batched rating prediction from review text.
+
+Predicting a user's aspect ratings for a list of candidate beers one
+(beer, aspect) pair at a time repeats the same work over and over. Here all
+of the candidate beers' sentences are scored against the user's model at
+once: the sentences become rows of a sparse word matrix, and the
+sentence-aspect probabilities, the per-sentence rating estimates, and the
+per-word best ratings all come out of a handful of matrix products.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+from constants import ASPECTS, RATINGS
+
+def get_rating_indices(ratings):
+    """Return the indices into RATINGS (1-5 in steps of 0.25) of an array of ratings."""
+    return np.clip(np.round((np.asarray(ratings, dtype=float) - RATINGS[0]) / (RATINGS[1] - RATINGS[0])),
+                   0, len(RATINGS) - 1).astype(int)
+
+def get_sentence_matrix(corpus, positions, user_model):
+    """Build a sparse (n_sentences, n_model_words) indicator matrix of the reviews' sentences.
+
+    Only words that the user's model knows are included. Also return the index
+    of the review (into positions) of each sentence.
+
+    """
+    starts = corpus.review_offsets[positions]
+    ends = corpus.review_offsets[positions + 1]
+    sentence_counts = ends - starts
+
+    # the corpus indices of all of the reviews' sentences, in review order
+    sentences = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)]) if len(positions) else np.zeros(0, dtype=int)
+    sentence_reviews = np.repeat(np.arange(len(positions)), sentence_counts)
+
+    word_starts = corpus.sentence_offsets[sentences]
+    word_ends = corpus.sentence_offsets[sentences + 1]
+    word_counts = word_ends - word_starts
+    words = np.concatenate([corpus.word_ids[s:e] for s, e in zip(word_starts, word_ends)]) if len(sentences) else np.zeros(0, dtype=int)
+    rows = np.repeat(np.arange(len(sentences)), word_counts)
+
+    # map corpus word ids to the model's columns, dropping unknown words
+    model_word_ids = user_model.word_ids
+    columns = np.searchsorted(model_word_ids, words)
+    columns[columns == len(model_word_ids)] = 0
+    known = model_word_ids[columns] == words if len(model_word_ids) else np.zeros(len(words), dtype=bool)
+
+    matrix = csr_matrix((np.ones(known.sum()), (rows[known], columns[known])), shape=(len(sentences), len(model_word_ids)))
+    return matrix, sentence_reviews
+
+def predict_aspect_ratings_from_text(username, beer_ids, df, corpus, model_store):
+    """Predict the user's rating of every aspect of every beer from the text of the beers' reviews.
+
+    For each review of a beer and each aspect, the sentence that the user most
+    probably would have written about the aspect is picked; its rating is the
+    average of the ratings its words imply, weighted by how strongly the user
+    associates each word with the aspect. A beer's prediction for an aspect is
+    the average over its reviews.
+
+    Parameters
+    ----------
+    username : string
+    beer_ids : list
+        The candidate beers.
+    df : DataFrame
+        The reviews; their text must be in the corpus.
+    corpus : Corpus
+    model_store : ModelStore
+
+    Returns
+    -------
+    DataFrame
+        Indexed by beer ID, with one column per aspect. Beers whose reviews
+        say nothing the user's model understands are NaN.
+
+    """
+    user_model = model_store.get(username)
+    num_aspects = len(ASPECTS)
+
+    reviews = df[df['beer_id'].isin(beer_ids)]
+    positions = np.array([corpus.get_position(i) for i in reviews.index], dtype=int)
+    review_ratings = get_rating_indices(reviews[ASPECTS].values)
+
+    matrix, sentence_reviews = get_sentence_matrix(corpus, positions, user_model)
+
+    theta = np.asarray(user_model.theta, dtype=float)
+    phi = np.asarray(user_model.phi, dtype=float)
+    num_words = theta.shape[1]
+
+    # sentence-aspect scores: the sum of theta[k][w] + phi[k][r_k][w] over the sentence's words,
+    # where r_k is the rating the sentence's review gave aspect k
+    theta_scores = np.asarray(matrix.dot(theta.T))
+    phi_scores = np.asarray(matrix.dot(phi.reshape(-1, num_words).T)).reshape(-1, num_aspects, len(RATINGS))
+    sentence_ratings = review_ratings[sentence_reviews]
+    phi_scores = phi_scores[np.arange(len(sentence_reviews))[:, np.newaxis], np.arange(num_aspects), sentence_ratings]
+
+    scores = theta_scores + phi_scores
+    exp_scores = np.exp(scores - scores.max(axis=1)[:, np.newaxis]) if len(scores) else scores
+    probs = exp_scores / exp_scores.sum(axis=1)[:, np.newaxis] if len(scores) else scores
+
+    # each sentence's rating for each aspect: the theta-weighted average of its words' best ratings
+    weighted = np.asarray(matrix.dot((theta * user_model.get_best_ratings()).T))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sentence_predictions = np.where(theta_scores != 0, weighted / theta_scores, np.nan)
+
+    # for each review and aspect, take the prediction of the review's most probable sentence
+    review_predictions = np.empty((len(positions), num_aspects))
+    review_predictions.fill(np.nan)
+    has_sentences = np.bincount(sentence_reviews, minlength=len(positions)) > 0
+    group_starts = np.searchsorted(sentence_reviews, np.arange(len(positions))[has_sentences])
+    for k in range(num_aspects):
+        order = np.lexsort((-probs[:, k], sentence_reviews))
+        review_predictions[has_sentences, k] = sentence_predictions[order[group_starts], k]
+
+    predictions = pd.DataFrame(review_predictions, columns=ASPECTS)
+    predictions['beer_id'] = reviews['beer_id'].values
+    return predictions.groupby('beer_id').mean().reindex(beer_ids)